@@ -0,0 +1,160 @@
+﻿from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from ..env import env_float, env_int
+
+
+class LimiterFull(Exception):
+    pass
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        initial: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        max_queue: int = 64,
+        backoff: float = 0.7,
+        latency_tolerance: float = 3.0,
+    ) -> None:
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.max_queue = max_queue
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.in_flight = 0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+
+        self.latency_ewma: Optional[float] = None
+        self.latency_floor: Optional[float] = None
+        self.acquired = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.increases = 0
+        self.decreases = 0
+        self.max_queue_depth = 0
+
+    async def acquire(self, deadline: Optional[float] = None) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self.acquired += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise LimiterFull(f"{self.name} queue is full")
+
+        waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=timeout)
+        except BaseException as exc:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as this waiter gave up.
+                self._release_slot()
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(exc, asyncio.TimeoutError):
+                self.timeouts += 1
+            raise
+        self.acquired += 1
+
+    def release(self, latency: Optional[float], overloaded: bool = False) -> None:
+        if overloaded:
+            self._decrease()
+        elif latency is not None:
+            self._observe(latency)
+        self._release_slot()
+
+    def depth(self) -> int:
+        return len(self._waiters)
+
+    def predicted_wait(self) -> float:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            return 0.0
+        latency = self.latency_ewma if self.latency_ewma is not None else 1.0
+        return (len(self._waiters) + 1) * latency / max(int(self.limit), 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "max_queue_depth": self.max_queue_depth,
+            "queue_capacity": self.max_queue,
+            "predicted_wait_ms": round(self.predicted_wait() * 1000.0, 2),
+            "latency_ewma_ms": _ms(self.latency_ewma),
+            "latency_floor_ms": _ms(self.latency_floor),
+            "acquired": self.acquired,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+    def _observe(self, latency: float) -> None:
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        if self.latency_floor is None or latency < self.latency_floor:
+            self.latency_floor = latency
+        else:
+            # Let the floor drift up slowly so one lucky sample does not pin it.
+            self.latency_floor += (latency - self.latency_floor) * 0.01
+        if latency > self.latency_floor * self.latency_tolerance:
+            self._decrease()
+        elif self.in_flight >= int(self.limit):
+            # Additive increase: about +1 per limit's worth of saturated calls.
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.increases += 1
+
+    def _decrease(self) -> None:
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        self.decreases += 1
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+
+def create_limiter(name: str) -> AdaptiveLimiter:
+    return AdaptiveLimiter(
+        name,
+        initial=env_int("LLM_LIMIT_INITIAL", 8, minimum=1),
+        min_limit=env_int("LLM_LIMIT_MIN", 1, minimum=1),
+        max_limit=env_int("LLM_LIMIT_MAX", 64, minimum=1),
+        max_queue=env_int("LLM_LIMIT_QUEUE", 64, minimum=0),
+        backoff=min(env_float("LLM_LIMIT_BACKOFF", 0.7), 1.0),
+        latency_tolerance=max(env_float("LLM_LIMIT_LATENCY_TOLERANCE", 3.0), 1.0),
+    )
+
+
+def is_overload(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status == 429:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return "429" in text or "rate limit" in text or "ratelimit" in text or "too many requests" in text
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000.0, 2) if value is not None else None
@@ -0,0 +1,146 @@
+﻿from __future__ import annotations
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Sequence
+
+import httpx
+from openai import DefaultAsyncHttpxClient
+from spoon_ai.llm import LLMManager
+from spoon_ai.schema import Message
+
+from ..env import env_int
+
+
+class ProviderPool:
+    def __init__(
+        self,
+        manager: LLMManager,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        idle_timeout: float = 120.0,
+        probe_timeout: float = 5.0,
+    ) -> None:
+        self.manager = manager
+        self.max_connections = max_connections
+        self.max_keepalive = min(max_keepalive, max_connections)
+        self.idle_timeout = idle_timeout
+        self.probe_timeout = probe_timeout
+        self._clients: Dict[str, Any] = {}
+        self._ready: Dict[str, Any] = {}
+        self._adopted: Dict[str, Any] = {}
+        self.last_used: Dict[str, float] = {}
+        self.probes: Dict[str, Dict[str, Any]] = {}
+        self.keepalives = 0
+
+    def prepare(self, provider: str) -> Any:
+        instance = self._ready.get(provider)
+        if instance is None:
+            config = self.manager.config_manager.load_provider_config(provider).model_dump()
+            instance = self._ready[provider] = self.manager.registry.get_provider(provider, config)
+        # LLMManager initializes providers lazily and may replace their client,
+        # so adopt whichever client it built into the pool.
+        client = getattr(instance, "client", None)
+        if client is None or client is self._adopted.get(provider):
+            return instance
+        if not hasattr(client, "with_options"):
+            return instance
+        http_client = self._clients.get(provider)
+        if http_client is None:
+            http_client = self._clients[provider] = DefaultAsyncHttpxClient(
+                timeout=client.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.idle_timeout,
+                ),
+            )
+        instance.client = self._adopted[provider] = client.with_options(http_client=http_client)
+        return instance
+
+    def touch(self, provider: str) -> None:
+        self.last_used[provider] = time.monotonic()
+
+    async def probe(self, provider: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            instance = self.prepare(provider)
+            if getattr(instance, "client", None) is None:
+                # Let LLMManager initialize the provider its own way; one
+                # token is the cheapest request it can make.
+                await asyncio.wait_for(
+                    self.manager.chat(
+                        [Message(role="user", content="ping")], provider=provider, max_tokens=1
+                    ),
+                    self.probe_timeout,
+                )
+                instance = self.prepare(provider)
+            if provider in self._clients:
+                # Listing models is free and opens the pooled TLS connection.
+                await asyncio.wait_for(instance.client.models.list(), self.probe_timeout)
+                result: Dict[str, Any] = {"ok": True, "probe": "models"}
+            else:
+                result = {"ok": True, "probe": "chat"}
+            self.touch(provider)
+        except Exception as exc:
+            result = {"ok": False, "error": str(exc)[:200] or type(exc).__name__}
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000.0, 2)
+        result["at"] = datetime.now(timezone.utc).isoformat()
+        self.probes[provider] = result
+        return result
+
+    async def warm(self, providers: Sequence[str], timeout: float) -> Dict[str, Dict[str, Any]]:
+        tasks = {provider: asyncio.ensure_future(self.probe(provider)) for provider in providers}
+        if tasks:
+            await asyncio.wait(tasks.values(), timeout=timeout)
+        results: Dict[str, Dict[str, Any]] = {}
+        for provider, task in tasks.items():
+            if task.done():
+                results[provider] = task.result()
+            else:
+                task.cancel()
+                self.probes[provider] = {"ok": False, "error": "warmup timeout"}
+                results[provider] = self.probes[provider]
+        return results
+
+    async def keepalive(self, providers: Sequence[str], interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            idle = [
+                provider
+                for provider in providers
+                if now - self.last_used.get(provider, 0.0) >= interval
+            ]
+            if idle:
+                self.keepalives += 1
+                await self.warm(idle, self.probe_timeout)
+
+    async def close(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+        self._ready.clear()
+        self._adopted.clear()
+        for client in clients:
+            await client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pooled": sorted(self._clients),
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "idle_timeout_s": self.idle_timeout,
+            "keepalives": self.keepalives,
+            "probes": dict(self.probes),
+        }
+
+
+def create_pool(manager: LLMManager) -> ProviderPool:
+    return ProviderPool(
+        manager,
+        max_connections=env_int("LLM_POOL_MAX_CONNECTIONS", 20, minimum=1),
+        max_keepalive=env_int("LLM_POOL_MAX_KEEPALIVE", 10, minimum=1),
+        idle_timeout=float(env_int("LLM_POOL_IDLE_TIMEOUT_S", 120, minimum=1)),
+        probe_timeout=env_int("LLM_WARMUP_TIMEOUT_MS", 5000, minimum=1) / 1000,
+    )
@@ -0,0 +1,226 @@
+﻿from __future__ import annotations
+
+import asyncio
+import contextvars
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ..env import env_int
+from ..storage.async_db import AsyncStorage
+from .llm_client import LLMClient
+from .usage import MESSAGE_OVERHEAD, WIDE_CHARS, estimate_tokens
+
+
+CHAT_ROLES = {"user", "assistant"}
+ROLE_LABELS = {"user": "用户", "assistant": "助手"}
+
+
+def truncate_tokens(text: str, budget: int, keep_tail: bool = False) -> str:
+    if estimate_tokens(text) <= budget:
+        return text
+    if budget <= 0:
+        return ""
+    chars = reversed(text) if keep_tail else iter(text)
+    kept: List[str] = []
+    used = 0.0
+    for char in chars:
+        used += 1.0 if WIDE_CHARS.match(char) else 0.25
+        if used > budget:
+            break
+        kept.append(char)
+    if keep_tail:
+        kept.reverse()
+        return "…" + "".join(kept[1:])
+    return "".join(kept[:-1]) + "…"
+
+
+def build_history(
+    history: Sequence[Dict[str, Any]],
+    summary: Optional[Dict[str, Any]],
+    budget: int,
+    summary_budget: int,
+    keep_recent: int = 4,
+    window: int = 0,
+) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    covered = summary["through_message_id"] if summary else 0
+    summary_text = truncate_tokens(summary["summary"], summary_budget, keep_tail=True) if summary else ""
+
+    messages: List[Dict[str, str]] = []
+    remaining = budget
+    if summary_text:
+        messages.append(
+            {"role": "system", "content": f"Summary of the earlier conversation:\n{summary_text}"}
+        )
+        remaining -= estimate_tokens(messages[0]["content"]) + MESSAGE_OVERHEAD
+
+    selected: List[Dict[str, Any]] = []
+    dropped = False
+    for item in reversed(history):
+        if item["id"] <= covered:
+            break
+        if item.get("role") not in CHAT_ROLES:
+            continue
+        content = item.get("content", "")
+        cost = estimate_tokens(content) + MESSAGE_OVERHEAD
+        if cost > remaining:
+            if not selected and remaining > MESSAGE_OVERHEAD:
+                content = truncate_tokens(content, remaining - MESSAGE_OVERHEAD, keep_tail=True)
+                selected.append({**item, "content": content})
+                remaining = 0
+            dropped = True
+            break
+        selected.append(item)
+        remaining -= cost
+    selected.reverse()
+
+    window_full = window > 0 and len(history) >= window and history[0]["id"] > covered
+    fold_through = 0
+    if selected and (dropped or window_full):
+        # Fold everything but the newest few messages so the next folds are batched.
+        fold_through = selected[0]["id"] - 1
+        if len(selected) > keep_recent:
+            fold_through = max(fold_through, selected[-keep_recent - 1]["id"])
+
+    messages.extend({"role": item["role"], "content": item["content"]} for item in selected)
+    usage = {
+        "messages": len(selected),
+        "tokens": budget - remaining,
+        "summary_through": covered or None,
+        "fold_through": fold_through or None,
+    }
+    return messages, usage
+
+
+class SessionSummarizer:
+    def __init__(
+        self,
+        storage: AsyncStorage,
+        llm_client: Optional[LLMClient],
+        summary_tokens: int = 400,
+        batch_size: int = 40,
+        timeout: float = 20.0,
+    ) -> None:
+        self.storage = storage
+        self.llm_client = llm_client
+        self.summary_tokens = summary_tokens
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._targets: Dict[str, int] = {}
+        self._tasks: Dict[str, "asyncio.Task[None]"] = {}
+
+        self.scheduled = 0
+        self.folds = 0
+        self.folded_messages = 0
+        self.extractive = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    def schedule(self, session_id: str, through_id: int) -> None:
+        if not session_id or through_id <= self._targets.get(session_id, 0):
+            return
+        self._targets[session_id] = through_id
+        self.scheduled += 1
+        if session_id not in self._tasks:
+            # A fresh context keeps the request's event sink and hedge budget out of the fold.
+            task = asyncio.get_running_loop().create_task(
+                self._refresh(session_id), context=contextvars.Context()
+            )
+            self._tasks[session_id] = task
+
+    async def close(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._tasks),
+            "scheduled": self.scheduled,
+            "folds": self.folds,
+            "folded_messages": self.folded_messages,
+            "extractive": self.extractive,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+    async def _refresh(self, session_id: str) -> None:
+        try:
+            while True:
+                target = self._targets[session_id]
+                current = await self.storage.get_summary(session_id)
+                through = current["through_message_id"] if current else 0
+                if through >= target:
+                    break
+                batch = await self.storage.list_messages(session_id, through, self.batch_size)
+                batch = [item for item in batch if item["id"] <= target]
+                if not batch:
+                    break
+                previous = current["summary"] if current else ""
+                summary, usage = await self._fold(previous, batch)
+                await self.storage.save_summary(session_id, summary, batch[-1]["id"])
+                if usage:
+                    await self.storage.add_usage(session_id, [{"node": "summary", **usage}])
+                self.folds += 1
+                self.folded_messages += len(batch)
+        except Exception as exc:
+            self.failures += 1
+            self.last_error = str(exc)[:200] or type(exc).__name__
+        finally:
+            self._tasks.pop(session_id, None)
+            self._targets.pop(session_id, None)
+
+    async def _fold(
+        self, previous: str, batch: List[Dict[str, Any]]
+    ) -> Tuple[str, Optional[Dict[str, Any]]]:
+        lines = [
+            f"{ROLE_LABELS.get(item['role'], item['role'])}: {truncate_tokens(item['content'], 200)}"
+            for item in batch
+            if item.get("role") in CHAT_ROLES
+        ]
+        summary = ""
+        usage: Optional[Dict[str, Any]] = None
+        if self.llm_client is not None:
+            payload = await self.llm_client.chat_json(
+                [
+                    {
+                        "role": "system",
+                        "content": (
+                            "You keep a running summary of a conversation between a user and "
+                            "a supportive companion. Merge the new messages into the existing "
+                            "summary, keeping the user's situation, feelings, decisions and open "
+                            f"questions. Write in Chinese, under {self.summary_tokens} characters. "
+                            "Return JSON only: {\"summary\": string}."
+                        ),
+                    },
+                    {
+                        "role": "user",
+                        "content": (
+                            f"Existing summary:\n{previous or '(none)'}\n\n"
+                            "New messages:\n" + "\n".join(lines)
+                        ),
+                    },
+                ],
+                fallback={},
+                hedge=False,
+                deadline=time.monotonic() + self.timeout,
+            )
+            value = payload.get("summary") if isinstance(payload, dict) else None
+            if isinstance(value, str):
+                summary = value.strip()
+            usage = payload.get("_usage") if isinstance(payload, dict) else None
+        if not summary:
+            self.extractive += 1
+            summary = "\n".join(part for part in [previous, *lines] if part)
+        return truncate_tokens(summary, self.summary_tokens, keep_tail=True), usage
+
+
+def create_summarizer(storage: AsyncStorage, llm_client: Optional[LLMClient]) -> SessionSummarizer:
+    return SessionSummarizer(
+        storage,
+        llm_client,
+        summary_tokens=env_int("ORACLE_CHOICE_SUMMARY_TOKENS", 400, minimum=32),
+        batch_size=env_int("ORACLE_CHOICE_SUMMARY_BATCH", 40, minimum=2),
+        timeout=env_int("ORACLE_CHOICE_SUMMARY_TIMEOUT_MS", 20000, minimum=1) / 1000,
+    )
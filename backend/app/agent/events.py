@@ -0,0 +1,29 @@
+﻿from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+
+EventSink = Callable[[Dict[str, Any]], None]
+
+_sink: ContextVar[Optional[EventSink]] = ContextVar("agent_event_sink", default=None)
+
+
+@contextmanager
+def event_sink(sink: EventSink) -> Iterator[None]:
+    token = _sink.set(sink)
+    try:
+        yield
+    finally:
+        _sink.reset(token)
+
+
+def streaming() -> bool:
+    return _sink.get() is not None
+
+
+def emit(event: Dict[str, Any]) -> None:
+    sink = _sink.get()
+    if sink is not None:
+        sink(event)
@@ -1,17 +1,28 @@
 ﻿from __future__ import annotations
 
-import copy
+import asyncio
+import os
+import time
 from datetime import datetime, timezone
-from typing import Any, Dict, List, TypedDict
+from typing import Any, Dict, List, Optional, TypedDict
 
 from spoon_ai.graph import StateGraph
 
+from ..env import env_int, env_ms
 from ..divination.tarot import draw_tarot
 from ..divination.lenormand import draw_lenormand
 from ..divination.liuyao import cast_liuyao
-from ..storage.db import Storage
-from .llm_client import LLMClient
-from .nodes import detect_intent, fallback_narration, parse_question, rule_route
+from ..storage.async_db import AsyncStorage
+from . import events
+from .context import SessionSummarizer, build_history, create_summarizer
+from .llm_client import LLMClient, remaining
+from .nodes import (
+    classify_question,
+    detect_intent,
+    fallback_narration,
+    parse_question,
+    rule_route,
+)
 
 
 class WorkflowState(TypedDict, total=False):
@@ -30,6 +41,12 @@ class WorkflowState(TypedDict, total=False):
     history: List[Dict[str, Any]]
     trace: List[Dict[str, Any]]
     persisted: bool
+    classified_tool: str
+    classified_by: str
+    deadline: float
+    budget_mark: float
+    usage: List[Dict[str, Any]]
+    trace_level: str
 
 
 TRACE_KEYS = [
@@ -49,46 +66,137 @@ TRACE_KEYS = [
 
 TRACE_ORDER = ["parse", "route", "divination", "narration", "persist"]
 
-
-def build_agent(storage: Storage):
-    llm_client = LLMClient(providers=["deepseek"])
+TRACE_LEVELS = {"off", "summary", "full"}
+DEFAULT_TRACE_LEVEL = "full"
+# Summary traces keep what scripts/classifier_eval.py replays.
+SUMMARY_INPUT_KEYS = {"parse": ["question", "force_divination"]}
+SUMMARY_OUTPUT_KEYS = {
+    "intent",
+    "domain",
+    "tone",
+    "need_clarification",
+    "tool",
+    "classifier",
+    "rule_confidence",
+    "fallback",
+    "persisted",
+}
+
+
+LLM_META_KEYS = {
+    "_provider": "llm_provider",
+    "_cache": "llm_cache",
+    "_coalesced": "llm_coalesced",
+    "_streamed": "llm_streamed",
+    "_hedge": "llm_hedge",
+    "_usage": "llm_usage",
+}
+LLM_FIELDS = set(LLM_META_KEYS.values())
+
+
+INTENTS = {"chat", "divination"}
+DOMAINS = {"love", "career", "general"}
+TONES = {"gentle", "direct"}
+TOOLS = {"tarot", "lenormand", "liuyao"}
+
+CLASSIFIER_MODES = {"split", "fused"}
+DEFAULT_RULE_THRESHOLD = 0.9
+
+
+def build_agent(
+    storage: AsyncStorage,
+    llm_client: Optional[LLMClient] = None,
+    classifier_mode: Optional[str] = None,
+    rule_threshold: Optional[float] = None,
+    summarizer: Optional[SessionSummarizer] = None,
+):
+    llm_client = llm_client or LLMClient()
+    summarizer = summarizer or create_summarizer(storage, llm_client)
+    history_tokens = env_int("ORACLE_CHOICE_HISTORY_TOKENS", 1500, minimum=64)
+    history_window = env_int("ORACLE_CHOICE_HISTORY_WINDOW", 20, minimum=1)
+    history_keep = env_int("ORACLE_CHOICE_HISTORY_KEEP", 4, minimum=0)
+    classifier_mode = classifier_mode or _classifier_mode()
+    if rule_threshold is None:
+        rule_threshold = _rule_threshold()
 
     async def parse_node(state: WorkflowState) -> Dict[str, Any]:
         input_snapshot = _trace_snapshot(state)
         question = state.get("question", "")
         force_divination = bool(state.get("force_divination"))
 
+        rules = classify_question(question, force_divination)
+        low_budget = _low_budget(state)
+        if low_budget or rules["confidence"] >= rule_threshold:
+            output = {
+                "intent": rules["intent"],
+                "domain": rules["domain"],
+                "tone": rules["tone"],
+                "need_clarification": rules["need_clarification"],
+                "classifier": "deadline" if low_budget else "rules",
+                "rule_confidence": rules["confidence"],
+            }
+            result = _with_trace(state, "parse", input_snapshot, output, "ok")
+            result["classified_tool"] = rules["tool"]
+            result["classified_by"] = output["classifier"]
+            return result
+
         fallback = parse_question(question)
         fallback_intent = "divination" if force_divination else detect_intent(question)
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                    "You are a classifier for oracle questions. "
-                    "Return JSON only: {\"intent\": \"chat|divination\", "
-                    "\"domain\": \"love|career|general\", "
-                    "\"tone\": \"gentle|direct\", \"need_clarification\": true|false}."
-                ),
-            },
-            {
-                "role": "user",
-                "content": (
-                    f"Question: {question}\n"
-                    "Decide intent, domain, tone, and whether more clarification is needed."
-                ),
-            },
-        ]
+        fused = classifier_mode == "fused"
+        if fused:
+            messages = [
+                {
+                    "role": "system",
+                    "content": (
+                        "You are a classifier and routing engine for oracle questions. "
+                        "Return JSON only: {\"intent\": \"chat|divination\", "
+                        "\"domain\": \"love|career|general\", "
+                        "\"tone\": \"gentle|direct\", \"need_clarification\": true|false, "
+                        "\"tool\": \"tarot|lenormand|liuyao\"}."
+                    ),
+                },
+                {
+                    "role": "user",
+                    "content": (
+                        f"Question: {question}\n"
+                        "Decide intent, domain, tone, whether more clarification is needed, "
+                        "and the best divination tool."
+                    ),
+                },
+            ]
+        else:
+            messages = [
+                {
+                    "role": "system",
+                    "content": (
+                        "You are a classifier for oracle questions. "
+                        "Return JSON only: {\"intent\": \"chat|divination\", "
+                        "\"domain\": \"love|career|general\", "
+                        "\"tone\": \"gentle|direct\", \"need_clarification\": true|false}."
+                    ),
+                },
+                {
+                    "role": "user",
+                    "content": (
+                        f"Question: {question}\n"
+                        "Decide intent, domain, tone, and whether more clarification is needed."
+                    ),
+                },
+            ]
 
-        payload = await llm_client.chat_json(messages, fallback=fallback)
-        provider_used = payload.get("_provider") if isinstance(payload, dict) else None
-        intent = payload.get("intent", fallback_intent)
+        payload = await llm_client.chat_json(
+            messages, fallback=fallback, cache=True, deadline=_llm_deadline(state)
+        )
+        intent = _choice(payload, "intent", INTENTS, fallback_intent)
         if force_divination:
             intent = "divination"
-        domain = payload.get("domain", fallback.get("domain"))
-        tone = payload.get("tone", fallback.get("tone"))
+        domain = _choice(payload, "domain", DOMAINS, fallback.get("domain"))
+        tone = _choice(payload, "tone", TONES, fallback.get("tone"))
         need_clarification = payload.get(
             "need_clarification", fallback.get("need_clarification")
         )
+        if not isinstance(need_clarification, bool):
+            need_clarification = fallback.get("need_clarification")
 
         output = {
             "intent": intent,
@@ -96,9 +204,18 @@ def build_agent(storage: Storage):
             "tone": tone,
             "need_clarification": bool(need_clarification),
         }
-        if provider_used:
-            output["llm_provider"] = provider_used
-        return _with_trace(state, "parse", input_snapshot, output, "ok")
+        output["classifier"] = classifier_mode
+        output["rule_confidence"] = rules["confidence"]
+        output.update(_llm_meta(payload))
+        if not fused:
+            return _with_trace(state, "parse", input_snapshot, output, "ok")
+
+        result = _with_trace(state, "parse", input_snapshot, output, "ok")
+        result["classified_tool"] = _choice(
+            payload, "tool", TOOLS, rule_route(question, domain, tone)
+        )
+        result["classified_by"] = "fused"
+        return result
 
     async def route_node(state: WorkflowState) -> Dict[str, Any]:
         input_snapshot = _trace_snapshot(state)
@@ -110,6 +227,15 @@ def build_agent(storage: Storage):
         tone = state.get("tone", "direct")
 
         fallback_tool = rule_route(question, domain, tone)
+        classified_tool = state.get("classified_tool")
+        if classified_tool:
+            tool = classified_tool if classified_tool in TOOLS else fallback_tool
+            output = {"tool": tool, "classifier": state.get("classified_by", classifier_mode)}
+            return _with_trace(state, "route", input_snapshot, output, "ok")
+        if _low_budget(state):
+            output = {"tool": fallback_tool, "classifier": "deadline"}
+            return _with_trace(state, "route", input_snapshot, output, "ok")
+
         messages = [
             {
                 "role": "system",
@@ -130,15 +256,16 @@ def build_agent(storage: Storage):
             },
         ]
 
-        payload = await llm_client.chat_json(messages, fallback={"tool": fallback_tool})
-        provider_used = payload.get("_provider") if isinstance(payload, dict) else None
-        tool = payload.get("tool") if isinstance(payload, dict) else None
-        if tool not in {"tarot", "lenormand", "liuyao"}:
-            tool = fallback_tool
+        payload = await llm_client.chat_json(
+            messages,
+            fallback={"tool": fallback_tool},
+            cache=True,
+            deadline=_llm_deadline(state),
+        )
+        tool = _choice(payload, "tool", TOOLS, fallback_tool)
 
-        output = {"tool": tool}
-        if provider_used:
-            output["llm_provider"] = provider_used
+        output = {"tool": tool, "classifier": classifier_mode}
+        output.update(_llm_meta(payload))
         return _with_trace(state, "route", input_snapshot, output, "ok")
 
     async def divination_node(state: WorkflowState) -> Dict[str, Any]:
@@ -179,8 +306,22 @@ def build_agent(storage: Storage):
         tone = state.get("tone", "direct")
         need_clarification = state.get("need_clarification", False)
 
+        streaming = events.streaming()
+        session_id = state.get("session_id", "")
+        context: Optional[Dict[str, Any]] = None
         if intent == "chat":
-            history = storage.get_recent_messages(state.get("session_id", ""), limit=5)
+            history, summary = await asyncio.gather(
+                storage.get_recent_messages(session_id, limit=history_window),
+                storage.get_summary(session_id),
+            )
+            history_messages, context = build_history(
+                history,
+                summary,
+                budget=history_tokens,
+                summary_budget=summarizer.summary_tokens,
+                keep_recent=history_keep,
+                window=history_window,
+            )
             messages = [
                 {
                     "role": "system",
@@ -190,11 +331,7 @@ def build_agent(storage: Storage):
                     ),
                 }
             ]
-            for item in history:
-                role = item.get("role")
-                if role not in {"user", "assistant"}:
-                    continue
-                messages.append({"role": role, "content": item.get("content", "")})
+            messages.extend(history_messages)
             messages.append({"role": "user", "content": question})
         else:
             messages = [
@@ -219,8 +356,20 @@ def build_agent(storage: Storage):
                 },
             ]
 
-        payload = await llm_client.chat_json(messages, fallback={})
-        provider_used = payload.get("_provider") if isinstance(payload, dict) else None
+        low_budget = _low_budget(state)
+        if low_budget:
+            payload: Dict[str, Any] = {}
+        elif streaming:
+            payload = await llm_client.chat_stream(
+                messages,
+                on_token=_emit_token,
+                fields=() if intent == "chat" else ("message",),
+                deadline=_llm_deadline(state),
+            )
+        else:
+            payload = await llm_client.chat_json(
+                messages, fallback={}, deadline=_llm_deadline(state)
+            )
         message = payload.get("message") if isinstance(payload, dict) else None
         if not message and isinstance(payload, dict):
             raw = payload.get("_raw")
@@ -231,10 +380,17 @@ def build_agent(storage: Storage):
                 message = "我在这里听你说。可以多告诉我一些你的感受或发生了什么吗？"
             else:
                 message = fallback_narration(tool, verdict, advice, tone, need_clarification)
+        if streaming and not payload.get("_streamed"):
+            _emit_token(message)
+        if context and context["fold_through"]:
+            summarizer.schedule(session_id, context["fold_through"])
 
         output = {"message": message}
-        if provider_used:
-            output["llm_provider"] = provider_used
+        output.update(_llm_meta(payload))
+        if context is not None:
+            output["context"] = context
+        if low_budget:
+            output["fallback"] = "deadline"
         return _with_trace(state, "narration", input_snapshot, output, "ok")
 
     async def persist_node(state: WorkflowState) -> Dict[str, Any]:
@@ -243,23 +399,21 @@ def build_agent(storage: Storage):
         if not session_id:
             return _with_trace(state, "persist", input_snapshot, {"persisted": False}, "ok")
 
-        trace = _normalize_trace(state.get("trace", []))
+        trace = _normalize_trace(state.get("trace") or [])
 
-        storage.upsert_session(session_id)
-        storage.add_message(session_id, "user", state.get("question", ""))
-        storage.add_message(session_id, "assistant", state.get("message", ""))
-        storage.add_reading(
+        await storage.record_turn(
             session_id,
-            state.get("tool", ""),
-            state.get("symbols", []),
-            state.get("verdict", ""),
-            state.get("advice", []),
+            question=state.get("question", ""),
+            message=state.get("message", ""),
+            tool=state.get("tool", ""),
+            symbols=state.get("symbols", []),
+            verdict=state.get("verdict", ""),
+            advice=state.get("advice", []),
+            trace=trace,
+            usage=state.get("usage", []),
         )
-        storage.add_trace(session_id, trace)
 
-        output = _with_trace(state, "persist", input_snapshot, {"persisted": True}, "ok")
-        output["trace"] = _normalize_trace(output.get("trace", []))
-        return output
+        return _with_trace(state, "persist", input_snapshot, {"persisted": True}, "ok")
 
     graph = StateGraph(WorkflowState)
     graph.add_node("parse", parse_node)
@@ -277,8 +431,73 @@ def build_agent(storage: Storage):
     return graph.compile()
 
 
+def _choice(payload: Any, key: str, allowed: set, fallback: Any) -> Any:
+    value = payload.get(key) if isinstance(payload, dict) else None
+    return value if value in allowed else fallback
+
+
+def _classifier_mode() -> str:
+    mode = os.getenv("ORACLE_CHOICE_CLASSIFIER", "split").strip().lower()
+    return mode if mode in CLASSIFIER_MODES else "split"
+
+
+def _rule_threshold() -> float:
+    raw = os.getenv("ORACLE_CHOICE_RULE_THRESHOLD", str(DEFAULT_RULE_THRESHOLD))
+    try:
+        return float(raw)
+    except ValueError:
+        return DEFAULT_RULE_THRESHOLD
+
+
+def _llm_deadline(state: WorkflowState) -> Optional[float]:
+    deadline = state.get("deadline")
+    if deadline is None:
+        return None
+    return deadline - env_ms("ORACLE_CHOICE_LLM_RESERVE_MS", 300)
+
+
+def _low_budget(state: WorkflowState) -> bool:
+    left = remaining(state.get("deadline"))
+    return left is not None and left < env_ms("ORACLE_CHOICE_NODE_MIN_BUDGET_MS", 750)
+
+
+def _budget_usage(state: WorkflowState, now: float) -> Optional[Dict[str, Any]]:
+    deadline = state.get("deadline")
+    if deadline is None:
+        return None
+    mark = state.get("budget_mark")
+    return {
+        "spent_ms": round((now - mark) * 1000.0, 2) if mark is not None else None,
+        "remaining_ms": round((deadline - now) * 1000.0, 2),
+    }
+
+
+def _emit_token(text: str) -> None:
+    events.emit({"event": "token", "text": text})
+
+
+def _llm_meta(payload: Any) -> Dict[str, Any]:
+    if not isinstance(payload, dict):
+        return {}
+    return {
+        field: payload[key]
+        for key, field in LLM_META_KEYS.items()
+        if payload.get(key) is not None
+    }
+
+
+def _trace_level(state: WorkflowState) -> str:
+    level = state.get("trace_level") or os.getenv("ORACLE_CHOICE_TRACE_LEVEL", "")
+    level = level.strip().lower()
+    return level if level in TRACE_LEVELS else DEFAULT_TRACE_LEVEL
+
+
 def _trace_snapshot(state: WorkflowState) -> Dict[str, Any]:
-    return {key: copy.deepcopy(state.get(key)) for key in TRACE_KEYS}
+    if _trace_level(state) != "full":
+        return {}
+    # Nodes replace state values instead of mutating them, so references stay
+    # valid until the trace is serialized on return or persist.
+    return {key: state.get(key) for key in TRACE_KEYS}
 
 
 def _with_trace(
@@ -288,19 +507,33 @@ def _with_trace(
     output: Dict[str, Any],
     status: str,
 ) -> Dict[str, Any]:
-    trace = list(state.get("trace", []))
-    trace.append(
-        {
-            "node": node,
-            "input": input_snapshot,
-            "output": copy.deepcopy(output),
-            "started_at": _utc_now(),
-            "ended_at": _utc_now(),
-            "status": status,
-        }
-    )
+    now = time.monotonic()
+    events.emit({"event": "node", "node": node, "output": output})
     output_with_trace = dict(output)
-    output_with_trace["trace"] = trace
+    output_with_trace["budget_mark"] = now
+    level = _trace_level(state)
+    if level != "off":
+        timestamp = _utc_now()
+        event: Dict[str, Any] = {"node": node}
+        if level == "full":
+            event["input"] = input_snapshot
+            event["output"] = output
+        else:
+            if node in SUMMARY_INPUT_KEYS:
+                event["input"] = {key: state.get(key) for key in SUMMARY_INPUT_KEYS[node]}
+            event["output"] = {
+                key: value
+                for key, value in output.items()
+                if key in SUMMARY_OUTPUT_KEYS or key in LLM_FIELDS
+            }
+        event.update(started_at=timestamp, ended_at=timestamp, status=status)
+        budget = _budget_usage(state, now)
+        if budget is not None:
+            event["budget"] = budget
+        # The state reducer appends lists, so return only the new event.
+        output_with_trace["trace"] = [event]
+    if output.get("llm_usage"):
+        output_with_trace["usage"] = [{"node": node, **output["llm_usage"]}]
     return output_with_trace
 
 
@@ -0,0 +1,194 @@
+﻿from __future__ import annotations
+
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+_DECODER = json.JSONDecoder()
+_STRUCTURAL = re.compile(r'[{}\[\]",:]')
+_STRING_STOP = re.compile(r'["\\]')
+_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class JsonFieldStream:
+    def __init__(self, fields: Iterable[str] = ()) -> None:
+        self.fields = set(fields)
+        self.values: Dict[str, str] = {}
+        self.result: Optional[Dict[str, Any]] = None
+        self._text = ""
+        self._pos = 0
+        self._reset_object()
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        if self.result is not None or not chunk:
+            return []
+        self._text += chunk
+        deltas: List[Tuple[str, str]] = []
+        text = self._text
+        pos = self._pos
+        end = len(text)
+
+        while pos < end:
+            if self._depth == 0:
+                start = text.find("{", pos)
+                if start == -1:
+                    text, pos, end = "", 0, 0
+                    break
+                text = text[start:]
+                pos, end = 1, len(text)
+                self._depth = 1
+                continue
+
+            if self._in_string:
+                match = _STRING_STOP.search(text, pos)
+                if match is None:
+                    self._string_part(text[pos:], deltas)
+                    pos = end
+                    break
+                index = match.start()
+                if index > pos:
+                    self._string_part(text[pos:index], deltas)
+                if text[index] == '"':
+                    self._end_string()
+                    pos = index + 1
+                    continue
+                decoded, length = _decode_escape(text, index)
+                if not length:
+                    # Wait for the rest of a split escape sequence.
+                    pos = index
+                    break
+                self._string_part(decoded, deltas)
+                pos = index + length
+                continue
+
+            match = _STRUCTURAL.search(text, pos)
+            if match is None:
+                pos = end
+                break
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                self._begin_string()
+            elif char in "{[":
+                if self._depth == 1 and self._expect == "value":
+                    self._expect = "after"
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    candidate = _load_object(text[:pos])
+                    if candidate is not None:
+                        self.result = candidate
+                        self._text, self._pos = "", 0
+                        return deltas
+                    self._reset_object()
+            elif self._depth == 1 and char == ":" and self._expect == "colon":
+                self._expect = "value"
+            elif self._depth == 1 and char == ",":
+                self._expect = "key"
+
+        self._text, self._pos = text, pos
+        return deltas
+
+    def close(self) -> Optional[Dict[str, Any]]:
+        self._text, self._pos = "", 0
+        return self.result
+
+    def _reset_object(self) -> None:
+        self._depth = 0
+        self._in_string = False
+        self._expect = "key"
+        self._role: Optional[str] = None
+        self._key_parts: List[str] = []
+        self._key: Optional[str] = None
+
+    def _begin_string(self) -> None:
+        self._in_string = True
+        self._role = None
+        if self._depth != 1:
+            return
+        if self._expect == "key":
+            self._role = "key"
+            self._key_parts = []
+        elif self._expect == "value":
+            # Each field streams at most once, even if a later object repeats it.
+            if self._key in self.fields and self._key not in self.values:
+                self._role = "field"
+                self.values[self._key] = ""
+            self._expect = "after"
+
+    def _string_part(self, part: str, deltas: List[Tuple[str, str]]) -> None:
+        if self._role == "key":
+            self._key_parts.append(part)
+        elif self._role == "field" and part:
+            assert self._key is not None
+            self.values[self._key] += part
+            deltas.append((self._key, part))
+
+    def _end_string(self) -> None:
+        if self._role == "key":
+            self._key = "".join(self._key_parts)
+            self._expect = "colon"
+        self._in_string = False
+        self._role = None
+
+
+def extract_json(text: str) -> Optional[Dict[str, Any]]:
+    start = text.find("{")
+    if start == -1:
+        return None
+    try:
+        value, _ = _DECODER.raw_decode(text, start)
+    except json.JSONDecodeError:
+        value = None
+    if isinstance(value, dict):
+        return value
+    stream = JsonFieldStream()
+    stream.feed(text[start:])
+    return stream.close()
+
+
+def _load_object(text: str) -> Optional[Dict[str, Any]]:
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def _decode_escape(text: str, index: int) -> Tuple[str, int]:
+    if index + 1 >= len(text):
+        return "", 0
+    char = text[index + 1]
+    if char != "u":
+        return _ESCAPES.get(char, char), 2
+    if index + 6 > len(text):
+        return "", 0
+    try:
+        code = int(text[index + 2 : index + 6], 16)
+    except ValueError:
+        return text[index : index + 6], 6
+    if 0xD800 <= code < 0xDC00:
+        if index + 12 > len(text):
+            if text[index + 6 : index + 8] in {"", "\\", "\\u"}:
+                return "", 0
+            return "�", 6
+        if text[index + 6 : index + 8] == "\\u":
+            try:
+                low = int(text[index + 8 : index + 12], 16)
+            except ValueError:
+                low = 0
+            if 0xDC00 <= low < 0xE000:
+                return chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)), 12
+        return "�", 6
+    return chr(code), 6
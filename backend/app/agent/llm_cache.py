@@ -0,0 +1,177 @@
+﻿from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..env import env_int
+
+
+DISK_SWEEP_INTERVAL_S = 60.0
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        max_bytes: int = 16 * 1024 * 1024,
+        ttl: float = 600.0,
+        disk_path: Optional[str] = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._bytes = 0
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_lock = threading.Lock()
+        self._next_sweep = 0.0
+        self.sweep_interval = min(ttl, DISK_SWEEP_INTERVAL_S)
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_swept = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None:
+            expires_at, raw = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(raw)
+            self._remove(key)
+            self.expirations += 1
+
+        if self.disk_path:
+            found = await asyncio.to_thread(self._disk_get, key, now)
+            if found is not None:
+                expires_at, raw = found
+                self._store(key, raw, expires_at)
+                self.disk_hits += 1
+                return json.loads(raw)
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, payload: Dict[str, Any]) -> None:
+        raw = json.dumps(payload, ensure_ascii=False)
+        expires_at = time.time() + self.ttl
+        self._store(key, raw, expires_at)
+        if self.disk_path:
+            await asyncio.to_thread(self._disk_set, key, raw, expires_at)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "disk_path": self.disk_path,
+            "disk_swept": self.disk_swept,
+        }
+
+    def _store(self, key: str, raw: str, expires_at: float) -> None:
+        size = len(raw.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at, raw)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, raw = self._entries.pop(key)
+        self._bytes -= len(raw.encode("utf-8"))
+
+    def _disk_connection(self) -> sqlite3.Connection:
+        if self._disk is None:
+            assert self.disk_path is not None
+            self._disk = sqlite3.connect(
+                self.disk_path, isolation_level=None, check_same_thread=False
+            )
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            self._disk.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_cache_expires_at ON llm_cache (expires_at)"
+            )
+        return self._disk
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[float, str]]:
+        with self._disk_lock:
+            row = self._disk_connection().execute(
+                "SELECT expires_at, payload FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[0] <= now:
+            return None
+        return float(row[0]), row[1]
+
+    def _disk_set(self, key: str, raw: str, expires_at: float) -> None:
+        with self._disk_lock:
+            conn = self._disk_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, payload, expires_at) VALUES (?, ?, ?)",
+                (key, raw, expires_at),
+            )
+            now = time.time()
+            if now >= self._next_sweep:
+                # Expired rows are already ignored on read, so sweeping them
+                # can wait; doing it on every write would slow the hot path.
+                self._next_sweep = now + self.sweep_interval
+                cursor = conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+                self.disk_swept += cursor.rowcount
+
+
+def cache_key(provider: str, kwargs: Dict[str, Any], messages: List[Dict[str, str]]) -> str:
+    normalized = {
+        "provider": provider,
+        "model": kwargs.get("model"),
+        "max_tokens": kwargs.get("max_tokens"),
+        "messages": [
+            [str(item.get("role") or "user").lower(), " ".join(str(item.get("content") or "").split())]
+            for item in messages
+        ],
+    }
+    raw = json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def create_response_cache() -> Optional[ResponseCache]:
+    if os.getenv("LLM_CACHE", "1").strip().lower() in {"0", "false", "no", "off"}:
+        return None
+    return ResponseCache(
+        max_entries=env_int("LLM_CACHE_MAX_ENTRIES", 2048, minimum=1),
+        max_bytes=env_int("LLM_CACHE_MAX_MB", 16, minimum=1) * 1024 * 1024,
+        ttl=float(env_int("LLM_CACHE_TTL_S", 600, minimum=1)),
+        disk_path=os.getenv("LLM_CACHE_PATH") or None,
+    )
@@ -1,14 +1,48 @@
 ﻿from __future__ import annotations
 
-import json
+import asyncio
 import os
-from typing import Any, Dict, List, Optional, Sequence, Union
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from spoon_ai.llm import ConfigurationManager, LLMManager
 from spoon_ai.schema import Message
 
+from ..env import env_int, env_ms
+from .concurrency import AdaptiveLimiter, LimiterFull, create_limiter, is_overload
+from .connection_pool import create_pool
+from .json_stream import JsonFieldStream, extract_json
+from .llm_cache import cache_key, create_response_cache
+from .provider_health import ProviderHealthRegistry
+from .single_flight import SingleFlight
+from .stub_llm import STUB_PROVIDER, StubLLM, create_stub
+from .usage import (
+    estimate_prompt_tokens,
+    estimate_tokens,
+    load_prices,
+    reported_tokens,
+    usage_record,
+)
+
 
 MessageLike = Union[Message, Dict[str, str]]
+T = TypeVar("T")
 
 PROVIDER_KEYS = {
     "gemini": "GEMINI_API_KEY",
@@ -16,44 +50,465 @@ PROVIDER_KEYS = {
     "deepseek": "DEEPSEEK_API_KEY",
 }
 
+HEDGE_MIN_SAMPLES = 5
+INTERNAL_ERRORS = (AttributeError, KeyError, TypeError)
+# Describe one call rather than the answer, so they are not cached.
+CALL_META_KEYS = {"_hedge", "_coalesced", "_cache", "_streamed"}
+
+_hedge_budget: ContextVar[Optional[List[int]]] = ContextVar("llm_hedge_budget", default=None)
+
+
+@contextmanager
+def hedge_budget(limit: Optional[int] = None) -> Iterator[None]:
+    if limit is None:
+        limit = _get_hedge_budget()
+    token = _hedge_budget.set([limit])
+    try:
+        yield
+    finally:
+        _hedge_budget.reset(token)
+
 
 class LLMClient:
     def __init__(self, providers: Optional[List[str]] = None) -> None:
-        ordered = providers or ["deepseek"]
+        ordered = providers or configured_providers()
         self.providers = _filter_providers(ordered)
         self._manager = LLMManager(ConfigurationManager())
+        self._stub: Optional[StubLLM] = create_stub() if STUB_PROVIDER in self.providers else None
+        self._pool = create_pool(self._manager)
+        self._keepalive_task: Optional["asyncio.Task[None]"] = None
+        self._cache = create_response_cache()
+        self._flights = SingleFlight() if _single_flight_enabled() else None
+        self.health = ProviderHealthRegistry(self.providers)
+        self._limiters = {provider: create_limiter(provider) for provider in self.providers}
+        self.hedge_stats = {"fired": 0, "backup_wins": 0, "budget_exhausted": 0}
+        self.stream_stats: Dict[str, Any] = {"internal_errors": 0, "last_internal_error": None}
+        self.prices = load_prices()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "providers": list(self.providers),
+            "cache": self._cache.stats() if self._cache else None,
+            "single_flight": self._flights.stats() if self._flights else None,
+            "hedge": dict(self.hedge_stats, enabled=_hedge_enabled()),
+            "stream": dict(self.stream_stats),
+            "concurrency": {
+                provider: limiter.stats() for provider, limiter in self._limiters.items()
+            },
+            "stub": self._stub.stats() if self._stub else None,
+            "pool": self._pool.stats(),
+        }
+
+    def provider_health(self) -> Dict[str, Dict[str, Any]]:
+        return self.health.snapshot()
+
+    def warmup_status(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self._pool.probes)
+
+    async def start(self) -> None:
+        remote = [provider for provider in self.providers if provider != STUB_PROVIDER]
+        if _warmup_enabled():
+            await self._pool.warm(remote, self._pool.probe_timeout)
+        interval = env_int("LLM_KEEPALIVE_S", 60)
+        if remote and interval and self._keepalive_task is None:
+            self._keepalive_task = asyncio.create_task(self._pool.keepalive(remote, interval))
+
+    async def close(self) -> None:
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            try:
+                await self._keepalive_task
+            except asyncio.CancelledError:
+                pass
+            self._keepalive_task = None
+        await self._pool.close()
 
     async def chat_json(
         self,
         messages: Sequence[MessageLike],
         fallback: Optional[Dict[str, Any]] = None,
+        cache: bool = False,
+        hedge: Optional[bool] = None,
+        deadline: Optional[float] = None,
     ) -> Dict[str, Any]:
         formatted = _to_messages(messages)
-        last_payload: Optional[Dict[str, Any]] = None
+        use_cache = cache and self._cache is not None
+        hedging = _hedge_enabled() if hedge is None else hedge
 
-        for provider in self.providers:
-            retries = _get_retries()
-            for _ in range(retries + 1):
-                try:
-                    response = await self._manager.chat(
-                        messages=formatted,
-                        provider=provider,
-                        **_provider_kwargs(provider),
+        index = 0
+        while index < len(self.providers) and not _expired(deadline):
+            provider = self.providers[index]
+            key = cache_key(provider, _provider_kwargs(provider), _message_dicts(formatted))
+            if use_cache:
+                cached = await self._cache.get(key)
+                if cached is not None:
+                    cached["_cache"] = "hit"
+                    _mark_cached(cached)
+                    return cached
+
+            backup = self.providers[index + 1] if index + 1 < len(self.providers) else None
+            try:
+                if hedging and backup is not None:
+                    payload, shared, tried = await _with_deadline(
+                        self._fetch_hedged(provider, backup, formatted, key, deadline), deadline
+                    )
+                else:
+                    payload, shared = await _with_deadline(
+                        self._fetch(provider, formatted, key, deadline), deadline
+                    )
+                    tried = 1
+            except asyncio.TimeoutError:
+                break
+            index += tried
+            if payload is None:
+                continue
+            if shared:
+                payload["_coalesced"] = True
+                _mark_cached(payload)
+            elif use_cache and "_raw" not in payload:
+                answered = payload.get("_provider", provider)
+                if answered != provider:
+                    # A hedged backup answered; file it under its own provider.
+                    key = cache_key(
+                        answered, _provider_kwargs(answered), _message_dicts(formatted)
                     )
-                    content = getattr(response, "content", "") or ""
-                    payload = _extract_json(content)
+                await self._cache.set(key, _cacheable(payload))
+            if use_cache and "_raw" not in payload:
+                payload["_cache"] = "miss"
+            return payload
+
+        return fallback or {}
+
+    async def _fetch(
+        self,
+        provider: str,
+        formatted: List[Message],
+        key: Optional[str] = None,
+        deadline: Optional[float] = None,
+    ) -> Tuple[Optional[Dict[str, Any]], bool]:
+        kwargs = _provider_kwargs(provider)
+        if self._flights is None:
+            return await self._call_provider(provider, formatted, kwargs, deadline), False
+        key = key or cache_key(provider, kwargs, _message_dicts(formatted))
+        # The shared call runs without a deadline; each caller is bounded by
+        # its own in chat_json, and the call is cancelled once all have left.
+        return await self._flights.do(
+            key, lambda: self._call_provider(provider, formatted, kwargs)
+        )
+
+    async def _fetch_hedged(
+        self,
+        primary: str,
+        backup: str,
+        formatted: List[Message],
+        key: str,
+        deadline: Optional[float] = None,
+    ) -> Tuple[Optional[Dict[str, Any]], bool, int]:
+        started = time.perf_counter()
+        tasks = {asyncio.ensure_future(self._fetch(primary, formatted, key, deadline)): primary}
+        delay: Optional[float] = self._hedge_delay(primary)
+        hedge_at: Optional[float] = None
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    delay = None
+                    if not _take_hedge():
+                        self.hedge_stats["budget_exhausted"] += 1
+                        continue
+                    hedge_at = time.perf_counter() - started
+                    tasks[
+                        asyncio.ensure_future(self._fetch(backup, formatted, deadline=deadline))
+                    ] = backup
+                    self.hedge_stats["fired"] += 1
+                    continue
+                for task in done:
+                    provider = tasks.pop(task)
+                    payload, shared = task.result()
                     if payload is None:
-                        if content:
-                            return {"_provider": provider, "_raw": content}
-                        last_payload = None
                         continue
-                    if isinstance(payload, dict):
-                        payload["_provider"] = provider
-                    return payload
-                except Exception:
+                    if hedge_at is not None:
+                        if provider == backup:
+                            self.hedge_stats["backup_wins"] += 1
+                        payload["_hedge"] = {
+                            "winner": provider,
+                            "delay_ms": round(hedge_at * 1000.0, 2),
+                            "latency_ms": round((time.perf_counter() - started) * 1000.0, 2),
+                        }
+                    return payload, shared, 1 if hedge_at is None else 2
+            return None, False, 1 if hedge_at is None else 2
+        finally:
+            # The slower request loses the race and is cancelled.
+            for task in tasks:
+                task.cancel()
+
+    def _hedge_delay(self, provider: str) -> float:
+        health = self.health.get(provider)
+        p90 = health.latency_percentile(0.9) if health.samples() >= HEDGE_MIN_SAMPLES else None
+        if p90 is None:
+            return env_ms("LLM_HEDGE_DELAY_MS", 1500)
+        return max(p90, env_ms("LLM_HEDGE_MIN_DELAY_MS", 50))
+
+    async def chat_stream(
+        self,
+        messages: Sequence[MessageLike],
+        on_token: Callable[[str], None],
+        fields: Sequence[str] = (),
+        deadline: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        formatted = _to_messages(messages)
+        for provider in self.providers:
+            if _expired(deadline):
+                break
+            chunks: List[str] = []
+            parser = JsonFieldStream(fields) if fields else None
+            json_mode = None if parser else False
+            sent = False
+            health = self.health.get(provider)
+            if not health.allow():
+                continue
+            limiter = await self._acquire(provider, deadline)
+            if limiter is None:
+                continue
+            started = time.perf_counter()
+            try:
+                transport = self._transport(provider)
+                stream = transport.chat_stream(
+                    messages=formatted,
+                    provider=provider,
+                    **_provider_kwargs(provider),
+                )
+                async for item in _until(stream, deadline):
+                    chunk = _chunk_text(item)
+                    if not chunk:
+                        continue
+                    chunks.append(chunk)
+                    if json_mode is None:
+                        # Decide from the first visible character whether the
+                        # model followed the JSON instruction or wrote prose.
+                        head = "".join(chunks).lstrip()
+                        if not head:
+                            continue
+                        json_mode = head[0] in "{`"
+                        chunk = "".join(chunks)
+                    if json_mode:
+                        for _, delta in parser.feed(chunk):
+                            on_token(delta)
+                            sent = True
+                    else:
+                        on_token(chunk)
+                        sent = True
+            except asyncio.CancelledError:
+                limiter.release(None)
+                health.release()
+                raise
+            except INTERNAL_ERRORS as exc:
+                # A bug on our side, or a changed SDK contract, says nothing
+                # about the provider, so keep it away from the breaker.
+                limiter.release(None)
+                health.release()
+                self.stream_stats["internal_errors"] += 1
+                self.stream_stats["last_internal_error"] = f"{type(exc).__name__}: {exc}"[:200]
+                if not sent:
+                    continue
+            except Exception as exc:
+                limiter.release(None, overloaded=is_overload(exc))
+                if _budget_spent(exc, deadline):
+                    health.release()
+                else:
+                    health.record_failure(time.perf_counter() - started, exc)
+                # Tokens already sent cannot be retracted, so only fail over
+                # to the next provider when nothing reached the client.
+                if not sent:
                     continue
+            else:
+                # Streams hold their slot for the whole response, so their
+                # latency is not comparable with chat calls.
+                limiter.release(None)
+                health.record_success(time.perf_counter() - started)
+            content = "".join(chunks)
+            if not content:
+                continue
+            payload: Dict[str, Any] = {"_raw": content}
+            if json_mode:
+                result = parser.close()
+                if result is not None:
+                    payload = dict(result)
+                elif parser.values:
+                    payload = {**parser.values, "_raw": content, "_partial": True}
+            payload["_provider"] = provider
+            kwargs = _provider_kwargs(provider)
+            payload["_usage"] = self._usage(provider, kwargs, formatted, content)
+            if sent:
+                payload["_streamed"] = True
+            return payload
+        return {}
+
+    async def _acquire(
+        self, provider: str, deadline: Optional[float]
+    ) -> Optional[AdaptiveLimiter]:
+        limiter = self.limiter(provider)
+        try:
+            await limiter.acquire(deadline)
+        except (LimiterFull, asyncio.TimeoutError):
+            # Shed locally instead of adding to the provider's overload.
+            self.health.get(provider).release()
+            return None
+        return limiter
+
+    def _transport(self, provider: str) -> Union[LLMManager, StubLLM]:
+        if provider == STUB_PROVIDER:
+            if self._stub is None:
+                self._stub = create_stub()
+            return self._stub
+        self._pool.prepare(provider)
+        self._pool.touch(provider)
+        return self._manager
+
+    def limiter(self, provider: str) -> AdaptiveLimiter:
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            limiter = self._limiters[provider] = create_limiter(provider)
+        return limiter
+
+    def admission_wait(self) -> float:
+        if not self.providers:
+            return 0.0
+        return self.limiter(self.providers[0]).predicted_wait()
+
+    async def _call_provider(
+        self,
+        provider: str,
+        formatted: List[Message],
+        kwargs: Dict[str, Any],
+        deadline: Optional[float] = None,
+    ) -> Optional[Dict[str, Any]]:
+        health = self.health.get(provider)
+        retries = _get_retries()
+        for attempt in range(retries + 1):
+            if attempt:
+                delay = _retry_delay(attempt)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    return None
+                await asyncio.sleep(delay)
+            if _expired(deadline) or not health.allow():
+                return None
+            limiter = await self._acquire(provider, deadline)
+            if limiter is None:
+                return None
+            started = time.perf_counter()
+            try:
+                transport = self._transport(provider)
+                # The remaining request budget is the per-attempt timeout.
+                response = await _with_deadline(
+                    transport.chat(messages=formatted, provider=provider, **kwargs),
+                    deadline,
+                )
+            except asyncio.CancelledError:
+                limiter.release(None)
+                health.release()
+                raise
+            except Exception as exc:
+                limiter.release(None, overloaded=is_overload(exc))
+                if _budget_spent(exc, deadline):
+                    health.release()
+                    return None
+                health.record_failure(time.perf_counter() - started, exc)
+                continue
+            latency = time.perf_counter() - started
+            limiter.release(latency)
+            health.record_success(latency)
+            content = getattr(response, "content", "") or ""
+            payload = _extract_json(content)
+            if payload is None:
+                if not content:
+                    continue
+                payload = {"_raw": content}
+            payload["_provider"] = provider
+            payload["_usage"] = self._usage(provider, kwargs, formatted, content, response)
+            return payload
+        return None
+
+    def _usage(
+        self,
+        provider: str,
+        kwargs: Dict[str, Any],
+        formatted: List[Message],
+        content: str,
+        response: Any = None,
+    ) -> Dict[str, Any]:
+        model = kwargs.get("model") or getattr(response, "model", None) or provider
+        counts = reported_tokens(response)
+        if counts is None:
+            prompt = estimate_prompt_tokens(str(item.content or "") for item in formatted)
+            return usage_record(
+                provider, model, prompt, estimate_tokens(content), self.prices, estimated=True
+            )
+        return usage_record(provider, model, counts[0], counts[1], self.prices)
 
-        return last_payload or fallback or {}
+
+def _chunk_text(chunk: Any) -> str:
+    # Newer SDKs stream LLMResponseChunk objects instead of plain strings.
+    if isinstance(chunk, str):
+        return chunk
+    return getattr(chunk, "delta", None) or ""
+
+
+def _cacheable(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in payload.items() if key not in CALL_META_KEYS}
+
+
+def _mark_cached(payload: Dict[str, Any]) -> None:
+    # Served without a provider call: the priced cost counts as saved, not spent.
+    usage = payload.get("_usage")
+    if isinstance(usage, dict):
+        payload["_usage"] = {**usage, "cached": True}
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def _expired(deadline: Optional[float]) -> bool:
+    left = remaining(deadline)
+    return left is not None and left <= 0
+
+
+def _budget_spent(error: BaseException, deadline: Optional[float]) -> bool:
+    # Our own request budget ran out, which says nothing about the provider.
+    return isinstance(error, asyncio.TimeoutError) and _expired(deadline)
+
+
+async def _with_deadline(awaitable: Awaitable[T], deadline: Optional[float]) -> T:
+    left = remaining(deadline)
+    if left is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, timeout=max(left, 0.0))
+
+
+async def _until(stream: AsyncIterator[str], deadline: Optional[float]) -> AsyncIterator[str]:
+    iterator = stream.__aiter__()
+    try:
+        while True:
+            try:
+                chunk = await _with_deadline(iterator.__anext__(), deadline)
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        close = getattr(iterator, "aclose", None)
+        if close is not None:
+            await close()
+
+
+def configured_providers() -> List[str]:
+    raw = os.getenv("LLM_PROVIDERS", "deepseek")
+    providers = [name.strip().lower() for name in raw.split(",") if name.strip()]
+    return providers or ["deepseek"]
 
 
 def _filter_providers(providers: List[str]) -> List[str]:
@@ -82,18 +537,15 @@ def _to_messages(messages: Sequence[MessageLike]) -> List[Message]:
     return formatted
 
 
+def _message_dicts(messages: List[Message]) -> List[Dict[str, str]]:
+    return [
+        {"role": str(getattr(item.role, "value", item.role)), "content": str(item.content or "")}
+        for item in messages
+    ]
+
+
 def _extract_json(text: str) -> Optional[Dict[str, Any]]:
-    cleaned = text.strip()
-    if cleaned.startswith("```"):
-        cleaned = cleaned.strip("`")
-    start = cleaned.find("{")
-    end = cleaned.rfind("}")
-    if start == -1 or end == -1 or end <= start:
-        return None
-    try:
-        return json.loads(cleaned[start : end + 1])
-    except json.JSONDecodeError:
-        return None
+    return extract_json(text)
 
 
 def _provider_kwargs(provider: str) -> Dict[str, Any]:
@@ -115,6 +567,16 @@ def _get_max_tokens() -> int:
     return min(max(value, 1), 8192)
 
 
+def _retry_delay(attempt: int) -> float:
+    raw = os.getenv("LLM_RETRY_BACKOFF_MS", "100")
+    try:
+        base = max(float(raw), 0.0) / 1000.0
+    except ValueError:
+        base = 0.1
+    delay = min(base * 2 ** (attempt - 1), 5.0)
+    return random.uniform(delay / 2, delay)
+
+
 def _get_retries() -> int:
     raw = os.getenv("LLM_RETRIES", "1")
     try:
@@ -122,3 +584,34 @@ def _get_retries() -> int:
     except ValueError:
         value = 1
     return max(value, 0)
+
+
+def _single_flight_enabled() -> bool:
+    return os.getenv("LLM_SINGLE_FLIGHT", "1").strip().lower() not in {"0", "false", "no", "off"}
+
+
+def _warmup_enabled() -> bool:
+    return os.getenv("LLM_WARMUP", "1").strip().lower() not in {"0", "false", "no", "off"}
+
+
+def _hedge_enabled() -> bool:
+    return os.getenv("LLM_HEDGE", "0").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _get_hedge_budget() -> int:
+    raw = os.getenv("LLM_HEDGE_BUDGET", "1")
+    try:
+        value = int(raw)
+    except ValueError:
+        value = 1
+    return max(value, 0)
+
+
+def _take_hedge() -> bool:
+    remaining = _hedge_budget.get()
+    if remaining is None:
+        return True
+    if remaining[0] <= 0:
+        return False
+    remaining[0] -= 1
+    return True
@@ -43,6 +43,7 @@ GENTLE_MARKERS = ["请", "希望", "麻烦", "能不能", "可以吗", "想", "
 DIRECT_MARKERS = ["直接", "快点", "说实话", "结论", "结果", "是或否", "只要结果", "别绕"]
 CAREER_ROUTE_HINTS = ["面试", "offer", "升职", "裁员", "跳槽", "绩效", "简历", "考试", "学习"]
 DIVINATION_KEYWORDS = ["占卜", "抽牌", "塔罗", "六爻", "雷诺曼", "算一算", "看运势", "问卜", "测一测"]
+SHORT_INPUT_SCORE = 0.3
 
 
 def parse_question(question: str) -> Dict[str, Any]:
@@ -82,6 +83,63 @@ def rule_route(question: str, domain: str, tone: str) -> str:
     return "tarot" if tone == "gentle" else "lenormand"
 
 
+def classify_question(question: str, force_divination: bool = False) -> Dict[str, Any]:
+    cleaned = (question or "").strip()
+    parsed = parse_question(cleaned)
+    intent = "divination" if force_divination else detect_intent(cleaned)
+
+    divination_hits = _count_hits(cleaned, DIVINATION_KEYWORDS)
+    if force_divination:
+        intent_score = 1.0
+    elif divination_hits:
+        intent_score = min(1.0, 0.85 + 0.05 * divination_hits)
+    else:
+        intent_score = 0.4
+
+    love_hits = _count_hits(cleaned, LOVE_KEYWORDS)
+    career_hits = _count_hits(cleaned, CAREER_KEYWORDS)
+    if love_hits and career_hits:
+        domain_score = 0.3
+    elif love_hits or career_hits:
+        domain_score = min(1.0, 0.6 + 0.15 * (love_hits + career_hits))
+    else:
+        domain_score = 0.5
+
+    gentle_hits = _count_hits(cleaned, GENTLE_MARKERS)
+    direct_hits = _count_hits(cleaned, DIRECT_MARKERS)
+    if direct_hits and not gentle_hits:
+        tone_score = min(1.0, 0.85 + 0.05 * direct_hits)
+    elif gentle_hits and not direct_hits:
+        tone_score = min(1.0, 0.6 + 0.1 * gentle_hits)
+    elif direct_hits:
+        tone_score = 0.5
+    else:
+        tone_score = 0.4
+
+    scores = {"intent": intent_score, "domain": domain_score, "tone": tone_score}
+    if parsed["need_clarification"]:
+        # Too short to classify: the clarification flag is certain, the rest is not.
+        scores = {key: min(value, SHORT_INPUT_SCORE) for key, value in scores.items()}
+    # Without tone markers "direct" is just the default, so it is reported
+    # in scores but does not hold back the other fields.
+    decided = [
+        value for key, value in scores.items() if key != "tone" or gentle_hits or direct_hits
+    ]
+    tool = rule_route(cleaned, parsed["domain"], parsed["tone"])
+    if intent == "chat":
+        tool = "chat"
+
+    return {
+        "intent": intent,
+        "domain": parsed["domain"],
+        "tone": parsed["tone"],
+        "need_clarification": parsed["need_clarification"],
+        "tool": tool,
+        "confidence": round(min(decided), 3),
+        "scores": {key: round(value, 3) for key, value in scores.items()},
+    }
+
+
 def fallback_narration(
     tool: str, verdict: str, advice: List[str] | str, tone: str, need_clarification: bool
 ) -> str:
@@ -108,3 +166,7 @@ def fallback_narration(
 
 def _contains_any(text: str, keywords: List[str]) -> bool:
     return any(keyword in text for keyword in keywords)
+
+
+def _count_hits(text: str, keywords: List[str]) -> int:
+    return sum(1 for keyword in keywords if keyword in text)
@@ -0,0 +1,155 @@
+﻿from __future__ import annotations
+
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from ..env import env_float, env_int
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderHealth:
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        error_rate: float = 0.5,
+        min_requests: int = 5,
+        base_backoff: float = 2.0,
+        max_backoff: float = 60.0,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        self.name = name
+        self.error_rate_threshold = error_rate
+        self.min_requests = min_requests
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._rng = rng or random.Random()
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._latencies: Deque[float] = deque(maxlen=window)
+
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.consecutive_trips = 0
+        self._probe_in_flight = False
+
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+        self.trips = 0
+        self.last_error: Optional[str] = None
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() < self.open_until:
+                self.rejected += 1
+                return False
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected += 1
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record_success(self, latency: float) -> None:
+        self.requests += 1
+        self._outcomes.append(True)
+        self._latencies.append(latency)
+        if self.state == HALF_OPEN:
+            self.state = CLOSED
+            self.consecutive_trips = 0
+            self._probe_in_flight = False
+            self._outcomes.clear()
+
+    def record_failure(self, latency: float, error: BaseException | str) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.last_error = str(error)[:200] or type(error).__name__
+        self._outcomes.append(False)
+        if self.state == HALF_OPEN:
+            self._trip()
+        elif self.state == CLOSED and self._should_trip():
+            self._trip()
+
+    def release(self) -> None:
+        # A probe that ended without an outcome (e.g. cancelled) frees the slot.
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = False
+
+    def samples(self) -> int:
+        return len(self._latencies)
+
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def latency_percentile(self, quantile: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, max(0, round(quantile * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50 = self.latency_percentile(0.5)
+        p95 = self.latency_percentile(0.95)
+        retry_in = max(0.0, self.open_until - time.monotonic()) if self.state == OPEN else 0.0
+        return {
+            "state": self.state,
+            "error_rate": round(self.error_rate(), 4),
+            "window": len(self._outcomes),
+            "p50_ms": round(p50 * 1000.0, 2) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000.0, 2) if p95 is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "trips": self.trips,
+            "retry_in_s": round(retry_in, 2),
+            "last_error": self.last_error,
+        }
+
+    def _should_trip(self) -> bool:
+        if len(self._outcomes) < self.min_requests:
+            return False
+        return self.error_rate() >= self.error_rate_threshold
+
+    def _trip(self) -> None:
+        self.trips += 1
+        self.consecutive_trips += 1
+        backoff = min(self.max_backoff, self.base_backoff * 2 ** (self.consecutive_trips - 1))
+        self.open_until = time.monotonic() + self._rng.uniform(backoff / 2, backoff)
+        self.state = OPEN
+        self._probe_in_flight = False
+
+
+class ProviderHealthRegistry:
+    def __init__(self, providers: List[str]) -> None:
+        self._providers = {name: _create_health(name) for name in providers}
+
+    def get(self, name: str) -> ProviderHealth:
+        health = self._providers.get(name)
+        if health is None:
+            health = self._providers[name] = _create_health(name)
+        return health
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: health.snapshot() for name, health in self._providers.items()}
+
+
+def _create_health(name: str) -> ProviderHealth:
+    return ProviderHealth(
+        name,
+        window=env_int("LLM_BREAKER_WINDOW", 20, minimum=1),
+        error_rate=env_float("LLM_BREAKER_ERROR_RATE", 0.5),
+        min_requests=env_int("LLM_BREAKER_MIN_REQUESTS", 5, minimum=1),
+        base_backoff=env_float("LLM_BREAKER_BASE_S", 2.0),
+        max_backoff=env_float("LLM_BREAKER_MAX_S", 60.0),
+    )
@@ -0,0 +1,66 @@
+﻿from __future__ import annotations
+
+import asyncio
+import copy
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+@dataclass
+class _Flight:
+    task: "asyncio.Future[Any]"
+    waiters: int = 0
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._flights: Dict[str, _Flight] = {}
+
+        self.leaders = 0
+        self.coalesced = 0
+        self.abandoned = 0
+        self.failed = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight(task=asyncio.ensure_future(factory()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every caller went away, so nobody wants the upstream result.
+                flight.task.cancel()
+                self._forget(key, flight)
+                self.abandoned += 1
+        return copy.deepcopy(result), shared
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "failed": self.failed,
+        }
+
+    def _finish(self, key: str, flight: _Flight) -> None:
+        self._forget(key, flight)
+        if not flight.task.cancelled() and flight.task.exception() is not None:
+            self.failed += 1
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
@@ -0,0 +1,161 @@
+﻿from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from spoon_ai.llm import LLMResponse
+from spoon_ai.schema import Message
+
+from ..env import env_float, env_int
+from .usage import estimate_prompt_tokens, estimate_tokens
+
+
+STUB_PROVIDER = "stub"
+
+SCHEMA_MARKER = "Return JSON only:"
+SCHEMA_FIELD = re.compile(r'"(\w+)"\s*:\s*("([^"]*)"|true\|false|string|number)')
+
+STUB_SENTENCES = [
+    "我听到了你的担心，先把最重要的一件事理清楚。",
+    "结果提示你放慢节奏，给自己一点观察的时间。",
+    "眼下的局面并不差，关键在于你如何回应变化。",
+    "不妨先和对方坦诚地聊一聊，再做决定。",
+    "把精力放在可以掌控的部分，其余的交给时间。",
+    "这段时间适合积累，而不是急着求一个答案。",
+]
+
+
+class StubProviderError(Exception):
+    def __init__(self, message: str, status_code: int = 500) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class StubLLM:
+    def __init__(
+        self,
+        seed: int = 0,
+        latency: float = 0.2,
+        jitter: float = 0.3,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        chunk_interval: float = 0.02,
+        chunk_chars: int = 4,
+    ) -> None:
+        self.seed = seed
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.chunk_interval = chunk_interval
+        self.chunk_chars = chunk_chars
+        self._rng = random.Random(seed)
+        self.calls = 0
+        self.streams = 0
+        self.errors = 0
+
+    async def chat(
+        self, messages: List[Message], provider: Optional[str] = None, **kwargs: Any
+    ) -> LLMResponse:
+        self.calls += 1
+        await asyncio.sleep(self._latency())
+        self._maybe_fail()
+        content = self.reply(messages)
+        prompt_tokens = estimate_prompt_tokens(m.content or "" for m in messages)
+        completion_tokens = estimate_tokens(content)
+        return LLMResponse(
+            content=content,
+            provider=STUB_PROVIDER,
+            model=kwargs.get("model") or STUB_PROVIDER,
+            finish_reason="stop",
+            native_finish_reason="stop",
+            usage={
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        )
+
+    async def chat_stream(
+        self, messages: List[Message], provider: Optional[str] = None, **kwargs: Any
+    ) -> AsyncIterator[str]:
+        self.streams += 1
+        await asyncio.sleep(self._latency())
+        self._maybe_fail()
+        content = self.reply(messages)
+        for start in range(0, len(content), self.chunk_chars):
+            if start:
+                await asyncio.sleep(self.chunk_interval)
+            yield content[start : start + self.chunk_chars]
+
+    def reply(self, messages: Sequence[Message]) -> str:
+        system = next((m.content or "" for m in messages if _role(m) == "system"), "")
+        question = next((m.content or "" for m in reversed(messages) if _role(m) == "user"), "")
+        rng = random.Random(_digest(self.seed, system, question))
+        if SCHEMA_MARKER not in system:
+            return _sentences(rng, 2)
+        schema = system.split(SCHEMA_MARKER, 1)[1]
+        payload: Dict[str, Any] = {}
+        for name, spec, choices in SCHEMA_FIELD.findall(schema):
+            if spec == "true|false":
+                payload[name] = rng.random() < 0.5
+            elif spec == "number":
+                payload[name] = round(rng.random(), 3)
+            elif spec == "string":
+                payload[name] = _sentences(rng, 3)
+            else:
+                payload[name] = rng.choice(choices.split("|"))
+        return json.dumps(payload, ensure_ascii=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "streams": self.streams,
+            "errors": self.errors,
+            "seed": self.seed,
+        }
+
+    def _latency(self) -> float:
+        if self.latency <= 0:
+            return 0.0
+        return self.latency * self._rng.lognormvariate(0.0, self.jitter)
+
+    def _maybe_fail(self) -> None:
+        roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            self.errors += 1
+            raise StubProviderError("429 Too Many Requests (stub)", status_code=429)
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.errors += 1
+            raise StubProviderError("stub provider error")
+
+
+def create_stub() -> StubLLM:
+    return StubLLM(
+        seed=env_int("LLM_STUB_SEED", 0),
+        latency=env_int("LLM_STUB_LATENCY_MS", 200) / 1000,
+        jitter=env_float("LLM_STUB_JITTER", 0.3),
+        error_rate=env_float("LLM_STUB_ERROR_RATE", 0.0),
+        rate_limit_rate=env_float("LLM_STUB_RATE_LIMIT_RATE", 0.0),
+        chunk_interval=env_int("LLM_STUB_CHUNK_MS", 20) / 1000,
+        chunk_chars=env_int("LLM_STUB_CHUNK_CHARS", 4, minimum=1),
+    )
+
+
+def _digest(seed: int, *parts: str) -> int:
+    hasher = hashlib.blake2b(str(seed).encode("utf-8"), digest_size=8)
+    for part in parts:
+        hasher.update(b"\x00" + part.encode("utf-8"))
+    return int.from_bytes(hasher.digest(), "big")
+
+
+def _role(message: Message) -> str:
+    return str(getattr(message.role, "value", message.role))
+
+
+def _sentences(rng: random.Random, count: int) -> str:
+    return "".join(rng.sample(STUB_SENTENCES, count))
@@ -0,0 +1,120 @@
+﻿from __future__ import annotations
+
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+
+WIDE_CHARS = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+MESSAGE_OVERHEAD = 4
+
+# USD per million tokens; override or extend with LLM_PRICES.
+DEFAULT_PRICES: Dict[str, Dict[str, float]] = {
+    "deepseek": {"prompt": 0.27, "completion": 1.10},
+    "openai": {"prompt": 0.15, "completion": 0.60},
+    "gemini": {"prompt": 0.10, "completion": 0.40},
+    "stub": {"prompt": 0.0, "completion": 0.0},
+}
+
+USAGE_FIELDS = [
+    "calls",
+    "cached_calls",
+    "estimated_calls",
+    "prompt_tokens",
+    "completion_tokens",
+    "cost_usd",
+    "saved_usd",
+]
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    wide = len(WIDE_CHARS.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def estimate_prompt_tokens(contents: Iterable[str]) -> int:
+    return sum(estimate_tokens(content) + MESSAGE_OVERHEAD for content in contents)
+
+
+def load_prices() -> Dict[str, Dict[str, float]]:
+    prices = {name: dict(price) for name, price in DEFAULT_PRICES.items()}
+    raw = os.getenv("LLM_PRICES", "").strip()
+    if not raw:
+        return prices
+    try:
+        overrides = json.loads(raw)
+    except ValueError:
+        return prices
+    if not isinstance(overrides, dict):
+        return prices
+    for name, price in overrides.items():
+        if isinstance(price, dict):
+            prices[str(name)] = {
+                "prompt": float(price.get("prompt", 0.0)),
+                "completion": float(price.get("completion", 0.0)),
+            }
+    return prices
+
+
+def reported_tokens(response: Any) -> Optional[Tuple[int, int]]:
+    usage = getattr(response, "usage", None)
+    if not isinstance(usage, dict):
+        return None
+    prompt = usage.get("prompt_tokens", usage.get("input_tokens"))
+    completion = usage.get("completion_tokens", usage.get("output_tokens"))
+    if not isinstance(prompt, int) or not isinstance(completion, int):
+        return None
+    return prompt, completion
+
+
+def usage_record(
+    provider: str,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    prices: Dict[str, Dict[str, float]],
+    estimated: bool = False,
+) -> Dict[str, Any]:
+    price = prices.get(f"{provider}/{model}") or prices.get(provider) or {}
+    cost = (
+        prompt_tokens * price.get("prompt", 0.0)
+        + completion_tokens * price.get("completion", 0.0)
+    ) / 1_000_000
+    return {
+        "provider": provider,
+        "model": model,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": round(cost, 8),
+        "cached": False,
+        "estimated": estimated,
+    }
+
+
+def summarize_usage(rows: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    totals = _empty_totals()
+    providers: Dict[str, Dict[str, Any]] = {}
+    nodes: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        for bucket in (
+            totals,
+            providers.setdefault(row["provider"], _empty_totals()),
+            nodes.setdefault(row["node"], _empty_totals()),
+        ):
+            for field in USAGE_FIELDS:
+                bucket[field] += row.get(field) or 0
+    for bucket in [totals, *providers.values(), *nodes.values()]:
+        _round_costs(bucket)
+    return {"totals": totals, "providers": providers, "nodes": nodes}
+
+
+def _empty_totals() -> Dict[str, Any]:
+    return {field: 0 for field in USAGE_FIELDS}
+
+
+def _round_costs(bucket: Dict[str, Any]) -> None:
+    bucket["cost_usd"] = round(bucket["cost_usd"], 6)
+    bucket["saved_usd"] = round(bucket["saved_usd"], 6)
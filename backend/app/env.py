@@ -0,0 +1,25 @@
+﻿from __future__ import annotations
+
+import os
+
+
+def env_int(name: str, default: int, minimum: int = 0) -> int:
+    raw = os.getenv(name, str(default))
+    try:
+        value = int(raw)
+    except ValueError:
+        value = default
+    return max(value, minimum)
+
+
+def env_float(name: str, default: float) -> float:
+    raw = os.getenv(name, str(default))
+    try:
+        value = float(raw)
+    except ValueError:
+        value = default
+    return max(value, 0.0)
+
+
+def env_ms(name: str, default: int) -> float:
+    return env_float(name, float(default)) / 1000.0
@@ -1,22 +1,40 @@
 ﻿from __future__ import annotations
 
-from typing import Any, Dict, List
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Set
 from uuid import uuid4
+import asyncio
+import hmac
+import json
+import math
 import os
+import time
 
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from .agent.context import create_summarizer
+from .agent.events import event_sink
+from .agent.usage import summarize_usage
 from .agent.graph_agent import build_agent
-from .agent.llm_client import _filter_providers, PROVIDER_KEYS
-from .storage.db import Storage
+from .agent.llm_client import (
+    LLMClient,
+    _filter_providers,
+    PROVIDER_KEYS,
+    configured_providers,
+    hedge_budget,
+)
+from .storage.async_db import AsyncStorage
+from .storage.sharding import create_storage
+from .env import env_int, env_ms
 
 
 load_dotenv(override=True)
 
-_enabled_providers = _filter_providers(["deepseek"])
+_enabled_providers = _filter_providers(configured_providers())
 _key_status = {
     name: "SET" if os.getenv(env_key) else "MISSING"
     for name, env_key in PROVIDER_KEYS.items()
@@ -24,7 +42,32 @@ _key_status = {
 print(f"LLM providers enabled: {_enabled_providers}")
 print(f"LLM key status: {_key_status}")
 
-app = FastAPI(title="Oracle's Choice", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    await storage.start()
+    # Open provider connections before the app starts taking traffic.
+    await llm_client.start()
+    yield
+    await _drain_streams(env_ms("ORACLE_CHOICE_SHUTDOWN_GRACE_MS", REQUEST_BUDGET_MS))
+    await summarizer.close()
+    await llm_client.close()
+    await storage.close()
+
+
+async def _drain_streams(timeout: float) -> None:
+    # Streamed turns outlive their response; let them persist before the
+    # storage they write to is closed, and cancel whatever overruns.
+    if not _stream_tasks:
+        return
+    _, pending = await asyncio.wait(set(_stream_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+app = FastAPI(title="Oracle's Choice", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,8 +77,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-storage = Storage()
-agent = build_agent(storage)
+storage = AsyncStorage(create_storage())
+llm_client = LLMClient()
+summarizer = create_summarizer(storage, llm_client)
+agent = build_agent(storage, llm_client, summarizer=summarizer)
+
+_admission_stats: Dict[str, int] = {"admitted": 0, "rejected": 0}
+_stream_tasks: Set["asyncio.Task[Dict[str, Any]]"] = set()
+_stream_stats: Dict[str, Any] = {
+    "streams": 0,
+    "errors": 0,
+    "ttft_ms_last": None,
+    "ttft_ms_max": 0.0,
+    "ttft_ms_total": 0.0,
+}
 
 
 class ChatRequest(BaseModel):
@@ -52,7 +107,47 @@ class ChatResponse(BaseModel):
     reading: Dict[str, Any]
 
 
+class HistoryPage(BaseModel):
+    session_id: str
+    items: List[Dict[str, Any]]
+    next_after_id: int | None = None
+
+
+class SearchPage(BaseModel):
+    query: str
+    items: List[Dict[str, Any]]
+    next_offset: int | None = None
+
+
 TRACE_ORDER = ["parse", "route", "divination", "narration", "persist"]
+REQUEST_BUDGET_MS = env_int("ORACLE_CHOICE_REQUEST_BUDGET_MS", 25000, minimum=1)
+TRACE_LEVEL_PATTERN = "^(off|summary|full)$"
+OPS_TOKEN = os.getenv("ORACLE_CHOICE_OPS_TOKEN", "").strip()
+
+
+def require_ops_token(authorization: str | None = Header(None)) -> None:
+    # Endpoints that read across sessions stay closed until a token is set.
+    if not OPS_TOKEN:
+        raise HTTPException(status_code=403, detail="ORACLE_CHOICE_OPS_TOKEN is not set.")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        token.strip().encode("utf-8"), OPS_TOKEN.encode("utf-8")
+    ):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid ops token.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+def _page(session_id: str, items: List[Dict[str, Any]], limit: int) -> HistoryPage:
+    next_after_id = items[-1]["id"] if len(items) == limit else None
+    return HistoryPage(session_id=session_id, items=items, next_after_id=next_after_id)
+
+
+def _ndjson(records: Iterator[Dict[str, Any]]) -> Iterator[bytes]:
+    for record in records:
+        yield (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
 
 
 def _normalize_trace(trace: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -64,17 +159,134 @@ def _normalize_trace(trace: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return [last_by_node[node] for node in TRACE_ORDER if node in last_by_node]
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(payload: ChatRequest) -> ChatResponse:
-    session_id = payload.session_id or str(uuid4())
-    context = await agent.invoke(
-        {
-            "session_id": session_id,
-            "question": payload.message,
-            "force_divination": bool(payload.force_divination),
-        }
+def _streaming_stats() -> Dict[str, Any]:
+    streams = _stream_stats["streams"]
+    return {
+        "streams": streams,
+        "errors": _stream_stats["errors"],
+        "in_flight": len(_stream_tasks),
+        "ttft_ms_last": _stream_stats["ttft_ms_last"],
+        "ttft_ms_avg": round(_stream_stats["ttft_ms_total"] / streams, 2) if streams else None,
+        "ttft_ms_max": _stream_stats["ttft_ms_max"],
+    }
+
+
+@app.get("/metrics", dependencies=[Depends(require_ops_token)])
+async def metrics() -> Dict[str, Any]:
+    return {
+        "storage": storage.stats(),
+        "llm": llm_client.stats(),
+        "streaming": _streaming_stats(),
+        "admission": dict(_admission_stats),
+        "summaries": summarizer.stats(),
+    }
+
+
+@app.get("/health/providers", dependencies=[Depends(require_ops_token)])
+async def health_providers() -> Dict[str, Any]:
+    return {
+        "providers": llm_client.provider_health(),
+        "warmup": llm_client.warmup_status(),
+        "keys": _key_status,
+    }
+
+
+@app.get("/usage", dependencies=[Depends(require_ops_token)])
+async def usage(
+    session_id: str | None = Query(None, min_length=1),
+    sessions: int = Query(10, ge=0, le=100),
+) -> Dict[str, Any]:
+    summary = summarize_usage(await storage.get_usage(session_id))
+    summary["prices"] = llm_client.prices
+    if session_id:
+        summary["session_id"] = session_id
+    elif sessions:
+        summary["sessions"] = await storage.get_usage_by_session(sessions)
+    return summary
+
+
+@app.get(
+    "/sessions/{session_id}/messages",
+    response_model=HistoryPage,
+    dependencies=[Depends(require_ops_token)],
+)
+async def session_messages(
+    session_id: str,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+) -> HistoryPage:
+    items = await storage.list_messages(session_id, after_id=after_id, limit=limit)
+    return _page(session_id, items, limit)
+
+
+@app.get(
+    "/sessions/{session_id}/readings",
+    response_model=HistoryPage,
+    dependencies=[Depends(require_ops_token)],
+)
+async def session_readings(
+    session_id: str,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+) -> HistoryPage:
+    items = await storage.list_readings(session_id, after_id=after_id, limit=limit)
+    return _page(session_id, items, limit)
+
+
+@app.get("/search", response_model=SearchPage, dependencies=[Depends(require_ops_token)])
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    kind: str | None = Query(None, pattern="^(message|reading)$"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+) -> SearchPage:
+    try:
+        items = await storage.search(q, kind=kind, limit=limit, offset=offset)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    next_offset = offset + limit if len(items) == limit else None
+    return SearchPage(query=q, items=items, next_offset=next_offset)
+
+
+@app.get("/export", dependencies=[Depends(require_ops_token)])
+async def export() -> StreamingResponse:
+    records = await storage.export()
+    return StreamingResponse(_ndjson(records), media_type="application/x-ndjson")
+
+
+def _admit() -> None:
+    # Shed load up front when the primary provider's queue could not drain
+    # within this request's deadline anyway.
+    wait = llm_client.admission_wait()
+    budget = REQUEST_BUDGET_MS / 1000.0
+    if wait <= budget:
+        _admission_stats["admitted"] += 1
+        return
+    _admission_stats["rejected"] += 1
+    raise HTTPException(
+        status_code=503,
+        detail="LLM providers are saturated, please retry later.",
+        headers={"Retry-After": str(max(1, math.ceil(wait - budget)))},
     )
 
+
+def _initial_state(
+    session_id: str, payload: ChatRequest, trace: str | None = None
+) -> Dict[str, Any]:
+    started = time.monotonic()
+    state: Dict[str, Any] = {
+        "session_id": session_id,
+        "question": payload.message,
+        "force_divination": bool(payload.force_divination),
+        "deadline": started + REQUEST_BUDGET_MS / 1000.0,
+        "budget_mark": started,
+    }
+    if trace:
+        state["trace_level"] = trace
+    return state
+
+
+def _chat_response(session_id: str, context: Dict[str, Any]) -> ChatResponse:
     reading = {
         "symbols": context.get("symbols", []),
         "verdict": context.get("verdict", ""),
@@ -85,6 +297,80 @@ async def chat(payload: ChatRequest) -> ChatResponse:
         session_id=session_id,
         message=context.get("message", ""),
         tool=context.get("tool", ""),
-        trace=_normalize_trace(context.get("trace", [])),
+        trace=_normalize_trace(context.get("trace") or []),
         reading=reading,
     )
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(
+    payload: ChatRequest,
+    trace: str | None = Query(None, pattern=TRACE_LEVEL_PATTERN),
+) -> ChatResponse:
+    _admit()
+    session_id = payload.session_id or str(uuid4())
+    with hedge_budget():
+        context = await agent.invoke(_initial_state(session_id, payload, trace))
+    return _chat_response(session_id, context)
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _chat_events(
+    session_id: str, payload: ChatRequest, trace: str | None = None
+) -> AsyncIterator[str]:
+    queue: asyncio.Queue[str] = asyncio.Queue()
+    started = time.perf_counter()
+    first_token: List[float] = []
+
+    def sink(event: Dict[str, Any]) -> None:
+        if event.get("event") == "token" and not first_token:
+            first_token.append(time.perf_counter() - started)
+        queue.put_nowait(_sse(event.get("event", "message"), event))
+
+    with event_sink(sink), hedge_budget():
+        task = asyncio.create_task(agent.invoke(_initial_state(session_id, payload, trace)))
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+    # A client that disconnects mid-stream does not cancel the turn; it is
+    # still persisted so the session history stays consistent.
+
+    yield _sse("session", {"session_id": session_id})
+    while not (task.done() and queue.empty()):
+        getter = asyncio.ensure_future(queue.get())
+        try:
+            await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not getter.done():
+                getter.cancel()
+        if getter.done() and not getter.cancelled():
+            yield getter.result()
+
+    _stream_stats["streams"] += 1
+    if first_token:
+        ttft_ms = first_token[0] * 1000.0
+        _stream_stats["ttft_ms_last"] = round(ttft_ms, 2)
+        _stream_stats["ttft_ms_max"] = round(max(_stream_stats["ttft_ms_max"], ttft_ms), 2)
+        _stream_stats["ttft_ms_total"] += ttft_ms
+    if task.exception() is not None:
+        _stream_stats["errors"] += 1
+        yield _sse("error", {"detail": "chat failed"})
+        return
+    response = _chat_response(session_id, task.result())
+    yield _sse("done", response.model_dump())
+
+
+@app.post("/chat/stream")
+async def chat_stream(
+    payload: ChatRequest,
+    trace: str | None = Query(None, pattern=TRACE_LEVEL_PATTERN),
+) -> StreamingResponse:
+    _admit()
+    session_id = payload.session_id or str(uuid4())
+    return StreamingResponse(
+        _chat_events(session_id, payload, trace),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -3,7 +3,6 @@
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Any, Dict, List
-import copy
 
 
 @dataclass
@@ -63,10 +62,12 @@ class GraphAgent:
                 status = "error"
             ended_at = _utc_now()
 
+            # Shallow copies: the growing trace stays out of the input, and
+            # nodes return new values instead of mutating the context.
             trace_event = TraceEvent(
                 node=node.name,
-                input=copy.deepcopy(ctx),
-                output=copy.deepcopy(output),
+                input={key: value for key, value in ctx.items() if key != "trace"},
+                output=dict(output),
                 started_at=started_at,
                 ended_at=ended_at,
                 status=status,
@@ -1 +1,3 @@
 ﻿from .db import Storage
+from .async_db import AsyncStorage
+from .sharding import ShardedStorage, create_storage
@@ -0,0 +1,238 @@
+﻿from __future__ import annotations
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import os
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, TypeVar
+
+from ..env import env_int
+from .db import Storage, _utc_now
+from .history_cache import HistoryCache
+from .sharding import ShardedStorage
+from .write_behind import WriteBehindQueue
+
+
+T = TypeVar("T")
+
+
+class AsyncStorage:
+    def __init__(
+        self,
+        storage: Storage | ShardedStorage | None = None,
+        max_workers: int | None = None,
+        write_behind: bool | None = None,
+    ) -> None:
+        self.storage = storage or Storage()
+        workers = max_workers or self.storage.readers + 1
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="oracle-storage"
+        )
+        if write_behind is None:
+            write_behind = _write_behind_enabled()
+        self.maintenance_interval = env_int("ORACLE_CHOICE_MAINTENANCE_INTERVAL_S", 3600, minimum=1)
+        self._maintenance_task: Optional[asyncio.Task] = None
+        self.last_maintenance: Optional[Dict[str, Any]] = None
+        self._history_cache: Optional[HistoryCache] = None
+        cache_sessions = env_int("ORACLE_CHOICE_HISTORY_CACHE_SESSIONS", 1024)
+        if cache_sessions:
+            self._history_cache = HistoryCache(
+                max_sessions=cache_sessions,
+                depth=env_int("ORACLE_CHOICE_HISTORY_CACHE_DEPTH", 20, minimum=1),
+                ttl=float(env_int("ORACLE_CHOICE_HISTORY_CACHE_TTL_S", 900, minimum=1)),
+            )
+        self._write_behind: Optional[WriteBehindQueue] = None
+        if write_behind:
+            self._write_behind = WriteBehindQueue(
+                self._flush_artifacts,
+                max_size=env_int("ORACLE_CHOICE_WRITE_BEHIND_QUEUE", 1000, minimum=1),
+                batch_size=env_int("ORACLE_CHOICE_WRITE_BEHIND_BATCH", 100, minimum=1),
+                put_timeout=env_int("ORACLE_CHOICE_WRITE_BEHIND_PUT_TIMEOUT_MS", 100) / 1000,
+                retries=env_int("ORACLE_CHOICE_WRITE_BEHIND_RETRIES", 3),
+                retry_backoff=env_int("ORACLE_CHOICE_WRITE_BEHIND_RETRY_MS", 50) / 1000,
+            )
+
+    async def init(self) -> None:
+        await self._run(self.storage.init)
+
+    async def start(self) -> None:
+        if self._write_behind is not None:
+            self._write_behind.start()
+        retention_enabled = self.storage.trace_max_age_days or self.storage.trace_max_per_session
+        if retention_enabled and self._maintenance_task is None:
+            self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+
+    async def flush(self) -> None:
+        if self._write_behind is not None:
+            await self._write_behind.flush()
+
+    async def close(self) -> None:
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+            self._maintenance_task = None
+        if self._write_behind is not None:
+            await self._write_behind.close()
+        await self._run(self.storage.close)
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "write_behind": self._write_behind.stats() if self._write_behind else None,
+            "maintenance": self.last_maintenance,
+            "history_cache": self._history_cache.stats() if self._history_cache else None,
+        }
+
+    async def run_maintenance(self) -> Dict[str, Any]:
+        await self.flush()
+        self.last_maintenance = await self._run(self.storage.run_maintenance)
+        return self.last_maintenance
+
+    async def upsert_session(self, session_id: str) -> None:
+        await self._run(self.storage.upsert_session, session_id)
+
+    async def add_message(self, session_id: str, role: str, content: str) -> None:
+        await self._run(self.storage.add_message, session_id, role, content)
+        if self._history_cache is not None:
+            self._history_cache.invalidate(session_id)
+
+    async def add_reading(
+        self,
+        session_id: str,
+        tool: str,
+        symbols: List[Dict[str, Any]],
+        verdict: str,
+        advice: List[str],
+    ) -> None:
+        await self._run(self.storage.add_reading, session_id, tool, symbols, verdict, advice)
+
+    async def add_trace(self, session_id: str, trace: List[Dict[str, Any]]) -> None:
+        await self._run(self.storage.add_trace, session_id, trace)
+
+    async def record_turn(
+        self,
+        session_id: str,
+        question: str,
+        message: str,
+        tool: str,
+        symbols: List[Dict[str, Any]],
+        verdict: str,
+        advice: List[str],
+        trace: List[Dict[str, Any]],
+        usage: Sequence[Dict[str, Any]] = (),
+    ) -> None:
+        if self._write_behind is None:
+            inserted = await self._run(
+                self.storage.record_turn,
+                session_id,
+                question,
+                message,
+                tool,
+                symbols,
+                verdict,
+                advice,
+                trace,
+                usage,
+            )
+            self._cache_messages(session_id, inserted)
+            return
+
+        inserted = await self._run(
+            self.storage.record_conversation, session_id, question, message
+        )
+        self._cache_messages(session_id, inserted)
+        artifacts = {
+            "session_id": session_id,
+            "tool": tool,
+            "symbols": symbols,
+            "verdict": verdict,
+            "advice": advice,
+            "trace": trace,
+            "usage": list(usage),
+            "created_at": _utc_now(),
+        }
+        if not await self._write_behind.put(artifacts):
+            await self._flush_artifacts([artifacts])
+
+    async def get_recent_messages(self, session_id: str, limit: int = 5) -> List[Dict[str, Any]]:
+        cache = self._history_cache
+        if cache is None:
+            return await self._run(self.storage.get_recent_messages, session_id, limit)
+
+        cached = cache.get(session_id, limit)
+        if cached is not None:
+            return cached
+
+        requested = max(limit, cache.depth)
+        token = cache.begin_load(session_id)
+        rows: Optional[List[Dict[str, Any]]] = None
+        try:
+            rows = await self._run(self.storage.get_recent_messages, session_id, requested)
+        finally:
+            cache.finish_load(session_id, token, rows, requested)
+        return rows[-limit:] if limit > 0 else []
+
+    async def get_traces(self, session_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        return await self._run(self.storage.get_traces, session_id, limit)
+
+    async def list_messages(
+        self, session_id: str, after_id: int = 0, limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        return await self._run(self.storage.list_messages, session_id, after_id, limit)
+
+    async def list_readings(
+        self, session_id: str, after_id: int = 0, limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        return await self._run(self.storage.list_readings, session_id, after_id, limit)
+
+    async def add_usage(self, session_id: str, usage: Sequence[Dict[str, Any]]) -> None:
+        await self._run(self.storage.add_usage, session_id, usage)
+
+    async def get_usage(self, session_id: str | None = None) -> List[Dict[str, Any]]:
+        await self.flush()
+        return await self._run(self.storage.get_usage, session_id)
+
+    async def get_usage_by_session(self, limit: int = 20) -> List[Dict[str, Any]]:
+        await self.flush()
+        return await self._run(self.storage.get_usage_by_session, limit)
+
+    async def get_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await self._run(self.storage.get_summary, session_id)
+
+    async def save_summary(self, session_id: str, summary: str, through_message_id: int) -> bool:
+        return await self._run(self.storage.save_summary, session_id, summary, through_message_id)
+
+    async def search(
+        self, query: str, kind: str | None = None, limit: int = 20, offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        return await self._run(self.storage.search, query, kind, limit, offset)
+
+    async def export(self, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        await self.flush()
+        return self.storage.iter_export(batch_size)
+
+    def _cache_messages(self, session_id: str, messages: List[Dict[str, Any]]) -> None:
+        if self._history_cache is not None:
+            self._history_cache.append(session_id, messages)
+
+    async def _maintenance_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.maintenance_interval)
+            try:
+                await self.run_maintenance()
+            except Exception as exc:
+                self.last_maintenance = {"error": str(exc), "ended_at": _utc_now()}
+
+    async def _flush_artifacts(self, turns: List[Dict[str, Any]]) -> None:
+        await self._run(self.storage.record_artifacts, turns)
+
+    async def _run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+
+def _write_behind_enabled() -> bool:
+    return os.getenv("ORACLE_CHOICE_WRITE_BEHIND", "").strip().lower() in {"1", "true", "yes", "on"}
@@ -2,10 +2,16 @@
 
 import json
 import os
+import queue
 import sqlite3
 import tempfile
-from datetime import datetime, timezone
-from typing import Any, Dict, List
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from ..env import env_int
+from .trace_codec import DELTA_ZLIB_CODEC, decode_trace_row, encode_trace
 
 
 SCHEMA = """
@@ -41,39 +47,278 @@ CREATE TABLE IF NOT EXISTS agent_traces (
 );
 """
 
+SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    applied_at TEXT NOT NULL
+)
+"""
+
+MIGRATIONS: List[Tuple[int, str]] = [
+    (1, SCHEMA),
+    (
+        2,
+        """
+        CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id);
+        CREATE INDEX IF NOT EXISTS idx_readings_session_id ON readings (session_id, id);
+        CREATE INDEX IF NOT EXISTS idx_agent_traces_session_id ON agent_traces (session_id, id);
+        """,
+    ),
+    (
+        3,
+        """
+        ALTER TABLE agent_traces ADD COLUMN payload BLOB;
+        ALTER TABLE agent_traces ADD COLUMN codec TEXT NOT NULL DEFAULT 'json';
+        CREATE INDEX IF NOT EXISTS idx_agent_traces_created_at ON agent_traces (created_at);
+        """,
+    ),
+    (
+        4,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            content,
+            kind UNINDEXED,
+            session_id UNINDEXED,
+            created_at UNINDEXED,
+            tokenize = 'trigram'
+        );
+        CREATE TRIGGER IF NOT EXISTS messages_search_insert AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO search_index (rowid, content, kind, session_id, created_at)
+            VALUES (new.id * 2, new.content, 'message', new.session_id, new.created_at);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_search_delete AFTER DELETE ON messages
+        BEGIN
+            DELETE FROM search_index WHERE rowid = old.id * 2;
+        END;
+        CREATE TRIGGER IF NOT EXISTS readings_search_insert AFTER INSERT ON readings
+        WHEN new.verdict != ''
+        BEGIN
+            INSERT INTO search_index (rowid, content, kind, session_id, created_at)
+            VALUES (
+                new.id * 2 + 1,
+                new.verdict || char(10) || new.advice,
+                'reading',
+                new.session_id,
+                new.created_at
+            );
+        END;
+        CREATE TRIGGER IF NOT EXISTS readings_search_delete AFTER DELETE ON readings
+        BEGIN
+            DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+        END;
+        """,
+    ),
+    (
+        5,
+        """
+        CREATE TABLE IF NOT EXISTS session_summaries (
+            session_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            through_message_id INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        """,
+    ),
+    (
+        6,
+        """
+        CREATE TABLE IF NOT EXISTS usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            node TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            model TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            cost_usd REAL NOT NULL,
+            cached INTEGER NOT NULL,
+            estimated INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_usage_session ON usage(session_id, id);
+        """,
+    ),
+]
+
+UPSERT_SESSION_SQL = """
+INSERT INTO sessions (id, created_at, last_active_at)
+VALUES (?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET last_active_at = excluded.last_active_at
+"""
+INSERT_MESSAGE_SQL = (
+    "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)"
+)
+LAST_MESSAGE_ID_SQL = "SELECT MAX(id) FROM messages WHERE session_id = ?"
+INSERT_READING_SQL = """
+INSERT INTO readings (session_id, tool, symbols, verdict, advice, created_at)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+INSERT_TRACE_SQL = """
+INSERT INTO agent_traces (session_id, trace, payload, codec, created_at)
+VALUES (?, '', ?, ?, ?)
+"""
+UPSERT_SUMMARY_SQL = """
+INSERT INTO session_summaries (session_id, summary, through_message_id, updated_at)
+VALUES (?, ?, ?, ?)
+ON CONFLICT(session_id) DO UPDATE SET
+    summary = excluded.summary,
+    through_message_id = excluded.through_message_id,
+    updated_at = excluded.updated_at
+WHERE excluded.through_message_id > session_summaries.through_message_id
+"""
+INSERT_USAGE_SQL = """
+INSERT INTO usage (
+    session_id, node, provider, model, prompt_tokens, completion_tokens,
+    cost_usd, cached, estimated, created_at
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+USAGE_TOTALS_SQL = """
+SUM(CASE WHEN cached = 0 THEN prompt_tokens ELSE 0 END) AS prompt_tokens,
+SUM(CASE WHEN cached = 0 THEN completion_tokens ELSE 0 END) AS completion_tokens,
+ROUND(SUM(CASE WHEN cached = 0 THEN cost_usd ELSE 0 END), 8) AS cost_usd,
+ROUND(SUM(CASE WHEN cached = 1 THEN cost_usd ELSE 0 END), 8) AS saved_usd,
+COUNT(*) AS calls,
+SUM(cached) AS cached_calls,
+SUM(estimated) AS estimated_calls
+"""
+PRUNE_BATCH_SIZE = 1000
+EXPORT_QUERIES = [
+    ("session", "SELECT id, created_at, last_active_at FROM sessions ORDER BY rowid"),
+    ("message", "SELECT id, session_id, role, content, created_at FROM messages ORDER BY id"),
+    (
+        "reading",
+        "SELECT id, session_id, tool, symbols, verdict, advice, created_at "
+        "FROM readings ORDER BY id",
+    ),
+    (
+        "trace",
+        "SELECT id, session_id, trace, payload, codec, created_at FROM agent_traces ORDER BY id",
+    ),
+    (
+        "summary",
+        "SELECT session_id, summary, through_message_id, updated_at "
+        "FROM session_summaries ORDER BY rowid",
+    ),
+    (
+        "usage",
+        "SELECT id, session_id, node, provider, model, prompt_tokens, completion_tokens, "
+        "cost_usd, cached, estimated, created_at FROM usage ORDER BY id",
+    ),
+]
+BACKFILL_QUERIES = [
+    (
+        "messages",
+        """
+        INSERT INTO search_index (rowid, content, kind, session_id, created_at)
+        SELECT id * 2, content, 'message', session_id, created_at
+        FROM messages
+        WHERE id > ? AND id <= ?
+          AND NOT EXISTS (SELECT 1 FROM search_index WHERE rowid = messages.id * 2)
+        """,
+    ),
+    (
+        "readings",
+        """
+        INSERT INTO search_index (rowid, content, kind, session_id, created_at)
+        SELECT id * 2 + 1, verdict || char(10) || advice, 'reading', session_id, created_at
+        FROM readings
+        WHERE id > ? AND id <= ? AND verdict != ''
+          AND NOT EXISTS (SELECT 1 FROM search_index WHERE rowid = readings.id * 2 + 1)
+        """,
+    ),
+]
+SEARCH_KINDS = {"message", "reading"}
+TRIGRAM_MIN_LENGTH = 3
+IMPORT_TABLES = {
+    "sessions",
+    "messages",
+    "readings",
+    "agent_traces",
+    "session_summaries",
+    "usage",
+}
+
+ID_TABLES = ("messages", "readings", "agent_traces", "usage")
+
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+STATEMENT_CACHE_SIZE = 64
+
 
 class Storage:
-    def __init__(self, db_path: str | None = None) -> None:
+    def __init__(
+        self,
+        db_path: str | None = None,
+        readers: int | None = None,
+        busy_timeout_ms: int | None = None,
+        synchronous: str | None = None,
+        cache_size_kb: int | None = None,
+        trace_max_age_days: int | None = None,
+        trace_max_per_session: int | None = None,
+    ) -> None:
         if db_path is None:
             db_path = _default_db_path()
         self.db_path = db_path
+        self.readers = readers if readers is not None else _get_readers()
+        self.busy_timeout_ms = (
+            busy_timeout_ms if busy_timeout_ms is not None else _get_busy_timeout_ms()
+        )
+        self.synchronous = _normalize_synchronous(synchronous or _get_synchronous())
+        self.cache_size_kb = cache_size_kb if cache_size_kb is not None else _get_cache_size_kb()
+        self.trace_max_age_days = (
+            trace_max_age_days
+            if trace_max_age_days is not None
+            else env_int("ORACLE_CHOICE_TRACE_MAX_AGE_DAYS", 0)
+        )
+        self.trace_max_per_session = (
+            trace_max_per_session
+            if trace_max_per_session is not None
+            else env_int("ORACLE_CHOICE_TRACE_MAX_PER_SESSION", 0)
+        )
+
+        self._write_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._idle_readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._reader_lock = threading.Lock()
+        self._reader_count = 0
+        self._closed = False
         self.init()
 
     def init(self) -> None:
-        with self._connect() as conn:
-            conn.executescript(SCHEMA)
-            conn.commit()
+        with self._write_lock:
+            conn = self._writer_connection()
+            conn.execute(SCHEMA_VERSION_SQL)
+            current = self._schema_version(conn)
+            for version, script in MIGRATIONS:
+                if version > current:
+                    self._apply_migration(conn, version, script)
+
+    def schema_version(self) -> int:
+        with self._read() as conn:
+            return self._schema_version(conn)
+
+    def close(self) -> None:
+        with self._write_lock:
+            self._closed = True
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                conn = self._idle_readers.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
 
     def upsert_session(self, session_id: str) -> None:
         now = _utc_now()
-        with self._connect() as conn:
-            conn.execute(
-                """
-                INSERT INTO sessions (id, created_at, last_active_at)
-                VALUES (?, ?, ?)
-                ON CONFLICT(id) DO UPDATE SET last_active_at = excluded.last_active_at
-                """,
-                (session_id, now, now),
-            )
-            conn.commit()
+        with self._write() as conn:
+            conn.execute(UPSERT_SESSION_SQL, (session_id, now, now))
 
     def add_message(self, session_id: str, role: str, content: str) -> None:
-        with self._connect() as conn:
-            conn.execute(
-                "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
-                (session_id, role, content, _utc_now()),
-            )
-            conn.commit()
+        with self._write() as conn:
+            conn.execute(INSERT_MESSAGE_SQL, (session_id, role, content, _utc_now()))
 
     def add_reading(
         self,
@@ -83,32 +328,116 @@ class Storage:
         verdict: str,
         advice: List[str],
     ) -> None:
-        payload_symbols = json.dumps(symbols, ensure_ascii=False)
-        payload_advice = json.dumps(advice, ensure_ascii=False)
-        with self._connect() as conn:
-            conn.execute(
-                """
-                INSERT INTO readings (session_id, tool, symbols, verdict, advice, created_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (session_id, tool, payload_symbols, verdict, payload_advice, _utc_now()),
-            )
-            conn.commit()
+        row = _reading_row(session_id, tool, symbols, verdict, advice, _utc_now())
+        with self._write() as conn:
+            conn.execute(INSERT_READING_SQL, row)
 
     def add_trace(self, session_id: str, trace: List[Dict[str, Any]]) -> None:
-        payload = json.dumps(trace, ensure_ascii=False)
-        with self._connect() as conn:
+        row = _trace_row(session_id, trace, _utc_now())
+        with self._write() as conn:
+            conn.execute(INSERT_TRACE_SQL, row)
+
+    def record_turn(
+        self,
+        session_id: str,
+        question: str,
+        message: str,
+        tool: str,
+        symbols: List[Dict[str, Any]],
+        verdict: str,
+        advice: List[str],
+        trace: List[Dict[str, Any]],
+        usage: Sequence[Dict[str, Any]] = (),
+    ) -> List[Dict[str, Any]]:
+        now = _utc_now()
+        with self._write() as conn:
+            inserted = self._insert_conversation(conn, session_id, question, message, now)
             conn.execute(
-                "INSERT INTO agent_traces (session_id, trace, created_at) VALUES (?, ?, ?)",
-                (session_id, payload, _utc_now()),
+                INSERT_READING_SQL, _reading_row(session_id, tool, symbols, verdict, advice, now)
             )
-            conn.commit()
+            if trace:
+                conn.execute(INSERT_TRACE_SQL, _trace_row(session_id, trace, now))
+            if usage:
+                conn.executemany(INSERT_USAGE_SQL, _usage_rows(session_id, usage, now))
+        return inserted
+
+    def record_conversation(
+        self, session_id: str, question: str, message: str
+    ) -> List[Dict[str, Any]]:
+        with self._write() as conn:
+            return self._insert_conversation(conn, session_id, question, message, _utc_now())
+
+    def record_artifacts(self, turns: List[Dict[str, Any]]) -> None:
+        if not turns:
+            return
+        readings = [
+            _reading_row(
+                turn["session_id"],
+                turn["tool"],
+                turn["symbols"],
+                turn["verdict"],
+                turn["advice"],
+                turn["created_at"],
+            )
+            for turn in turns
+        ]
+        traces = [
+            _trace_row(turn["session_id"], turn["trace"], turn["created_at"])
+            for turn in turns
+            if turn["trace"]
+        ]
+        usage = [
+            row
+            for turn in turns
+            for row in _usage_rows(turn["session_id"], turn.get("usage", ()), turn["created_at"])
+        ]
+        with self._write() as conn:
+            conn.executemany(INSERT_READING_SQL, readings)
+            if traces:
+                conn.executemany(INSERT_TRACE_SQL, traces)
+            if usage:
+                conn.executemany(INSERT_USAGE_SQL, usage)
+
+    def add_usage(self, session_id: str, usage: Sequence[Dict[str, Any]]) -> None:
+        if not usage:
+            return
+        with self._write() as conn:
+            conn.executemany(INSERT_USAGE_SQL, _usage_rows(session_id, usage, _utc_now()))
+
+    def import_rows(
+        self, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]
+    ) -> int:
+        if table not in IMPORT_TABLES:
+            raise ValueError(f"Unknown table: {table}")
+        column_list = ", ".join(columns)
+        placeholders = ", ".join("?" for _ in columns)
+        verb = "INSERT OR IGNORE" if table == "sessions" else "INSERT"
+        with self._write() as conn:
+            cursor = conn.executemany(
+                f"{verb} INTO {table} ({column_list}) VALUES ({placeholders})", rows
+            )
+        return cursor.rowcount
+
+    def reserve_ids(self, floor: int) -> None:
+        # AUTOINCREMENT continues from max(seq, max(id)), so raising the
+        # sequence moves new rows into [floor, ...) without touching old ones.
+        with self._write() as conn:
+            for table in ID_TABLES:
+                conn.execute(
+                    "UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?",
+                    (floor, table, floor),
+                )
+                conn.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? "
+                    "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+                    (table, floor, table),
+                )
 
     def get_recent_messages(self, session_id: str, limit: int = 5) -> List[Dict[str, Any]]:
-        with self._connect() as conn:
+        with self._read() as conn:
             rows = conn.execute(
                 """
-                SELECT role, content, created_at
+                SELECT id, role, content, created_at
                 FROM messages
                 WHERE session_id = ?
                 ORDER BY id DESC
@@ -117,18 +446,460 @@ class Storage:
                 (session_id, limit),
             ).fetchall()
         history = [
-            {"role": row["role"], "content": row["content"], "created_at": row["created_at"]}
+            {
+                "id": row["id"],
+                "role": row["role"],
+                "content": row["content"],
+                "created_at": row["created_at"],
+            }
             for row in rows
         ]
         history.reverse()
         return history
 
+    def list_messages(
+        self, session_id: str, after_id: int = 0, limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        with self._read() as conn:
+            rows = conn.execute(
+                """
+                SELECT id, role, content, created_at
+                FROM messages
+                WHERE session_id = ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+                """,
+                (session_id, after_id, limit),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def list_readings(
+        self, session_id: str, after_id: int = 0, limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        with self._read() as conn:
+            rows = conn.execute(
+                """
+                SELECT id, tool, symbols, verdict, advice, created_at
+                FROM readings
+                WHERE session_id = ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+                """,
+                (session_id, after_id, limit),
+            ).fetchall()
+        return [_reading_from_row(row) for row in rows]
+
+    def iter_export(self, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            # One read transaction keeps the export on a single WAL snapshot.
+            conn.execute("BEGIN")
+            for record_type, sql in EXPORT_QUERIES:
+                cursor = conn.execute(sql)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield _export_record(record_type, row)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def search(
+        self, query: str, kind: str | None = None, limit: int = 20, offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        text = query.strip()
+        if not text:
+            return []
+        if kind is not None and kind not in SEARCH_KINDS:
+            raise ValueError(f"Unknown search kind: {kind}")
+
+        kind_filter = "AND kind = ?" if kind else ""
+        kind_params: Tuple[Any, ...] = (kind,) if kind else ()
+        if len(text) >= TRIGRAM_MIN_LENGTH:
+            phrase = '"' + text.replace('"', '""') + '"'
+            sql = f"""
+                SELECT rowid, kind, session_id, created_at,
+                       snippet(search_index, 0, '[', ']', '…', 16) AS snippet,
+                       bm25(search_index) AS score
+                FROM search_index
+                WHERE search_index MATCH ? {kind_filter}
+                ORDER BY score, rowid DESC
+                LIMIT ? OFFSET ?
+            """
+            params: Tuple[Any, ...] = (phrase, *kind_params, limit, offset)
+        else:
+            # Trigram tokens need at least three characters, so one- and
+            # two-character terms (common in Chinese) fall back to a scan.
+            sql = f"""
+                SELECT rowid, kind, session_id, created_at,
+                       substr(content, 1, 120) AS snippet,
+                       NULL AS score
+                FROM search_index
+                WHERE content LIKE ? ESCAPE '\\' {kind_filter}
+                ORDER BY rowid DESC
+                LIMIT ? OFFSET ?
+            """
+            params = (f"%{_escape_like(text)}%", *kind_params, limit, offset)
+
+        with self._read() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [
+            {
+                "kind": row["kind"],
+                "id": row["rowid"] // 2,
+                "session_id": row["session_id"],
+                "created_at": row["created_at"],
+                "snippet": row["snippet"],
+                "score": row["score"],
+            }
+            for row in rows
+        ]
+
+    def backfill_search_index(self, batch_size: int = 5000) -> Dict[str, int]:
+        indexed: Dict[str, int] = {}
+        for table, sql in BACKFILL_QUERIES:
+            with self._read() as conn:
+                min_id, max_id = conn.execute(
+                    f"SELECT COALESCE(MIN(id), 1), COALESCE(MAX(id), 0) FROM {table}"
+                ).fetchone()
+            total = 0
+            for start in range(min_id - 1, max_id, batch_size):
+                with self._write() as conn:
+                    cursor = conn.execute(sql, (start, min(start + batch_size, max_id)))
+                total += max(cursor.rowcount, 0)
+            indexed[table] = total
+        return indexed
+
+    def get_traces(self, session_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._read() as conn:
+            rows = conn.execute(
+                """
+                SELECT id, trace, payload, codec, created_at
+                FROM agent_traces
+                WHERE session_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+                """,
+                (session_id, limit),
+            ).fetchall()
+        return [
+            {
+                "id": row["id"],
+                "trace": decode_trace_row(row["trace"], row["payload"], row["codec"]),
+                "created_at": row["created_at"],
+            }
+            for row in rows
+        ]
+
+    def get_usage(self, session_id: str | None = None) -> List[Dict[str, Any]]:
+        where = "WHERE session_id = ?" if session_id else ""
+        params = (session_id,) if session_id else ()
+        with self._read() as conn:
+            rows = conn.execute(
+                f"SELECT provider, node, {USAGE_TOTALS_SQL} FROM usage {where} "
+                "GROUP BY provider, node",
+                params,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_usage_by_session(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._read() as conn:
+            rows = conn.execute(
+                f"SELECT session_id, {USAGE_TOTALS_SQL} FROM usage "
+                "GROUP BY session_id ORDER BY cost_usd DESC, calls DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._read() as conn:
+            row = conn.execute(
+                """
+                SELECT summary, through_message_id, updated_at
+                FROM session_summaries
+                WHERE session_id = ?
+                """,
+                (session_id,),
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def save_summary(self, session_id: str, summary: str, through_message_id: int) -> bool:
+        with self._write() as conn:
+            cursor = conn.execute(
+                UPSERT_SUMMARY_SQL, (session_id, summary, through_message_id, _utc_now())
+            )
+        return cursor.rowcount > 0
+
+    def prune_traces(self) -> int:
+        deleted = 0
+        if self.trace_max_age_days > 0:
+            cutoff = (
+                datetime.now(timezone.utc) - timedelta(days=self.trace_max_age_days)
+            ).isoformat()
+            deleted += self._delete_in_batches(
+                "SELECT id FROM agent_traces WHERE created_at < ? LIMIT ?", (cutoff,)
+            )
+        if self.trace_max_per_session > 0:
+            deleted += self._delete_in_batches(
+                """
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY session_id ORDER BY id DESC
+                    ) AS position
+                    FROM agent_traces
+                )
+                WHERE position > ?
+                LIMIT ?
+                """,
+                (self.trace_max_per_session,),
+            )
+        return deleted
+
+    def compact(self, max_pages: int = 0, full: bool = False) -> Dict[str, Any]:
+        with self._write_lock:
+            conn = self._writer_connection()
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if auto_vacuum == 2:
+                conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+                mode = "incremental"
+            elif free_before and full:
+                # Legacy files were created without auto_vacuum; a full VACUUM
+                # rebuilds them with the incremental mode set in _connect().
+                conn.execute("VACUUM")
+                mode = "full"
+            elif free_before:
+                # A full VACUUM would block every write while it rewrites the
+                # file, so it is left to scripts/compact_db.py.
+                mode = "needs_full_vacuum"
+            else:
+                mode = "none"
+            free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return {"mode": mode, "freed_pages": free_before - free_after}
+
+    def run_maintenance(self) -> Dict[str, Any]:
+        started = datetime.now(timezone.utc)
+        pruned = self.prune_traces()
+        compacted = self.compact()
+        return {
+            "pruned_traces": pruned,
+            "compaction": compacted,
+            "started_at": started.isoformat(),
+            "ended_at": _utc_now(),
+        }
+
+    def _delete_in_batches(self, select_ids_sql: str, params: Tuple[Any, ...]) -> int:
+        deleted = 0
+        while True:
+            with self._write() as conn:
+                cursor = conn.execute(
+                    f"DELETE FROM agent_traces WHERE id IN ({select_ids_sql})",
+                    (*params, PRUNE_BATCH_SIZE),
+                )
+            deleted += cursor.rowcount
+            if cursor.rowcount < PRUNE_BATCH_SIZE:
+                return deleted
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        with self._write_lock:
+            conn = self._writer_connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _insert_conversation(
+        self, conn: sqlite3.Connection, session_id: str, question: str, message: str, now: str
+    ) -> List[Dict[str, Any]]:
+        conn.execute(UPSERT_SESSION_SQL, (session_id, now, now))
+        # Ids are global, so record each row's predecessor in this session to
+        # let the history cache tell whether it saw every message in between.
+        previous_id = conn.execute(LAST_MESSAGE_ID_SQL, (session_id,)).fetchone()[0] or 0
+        inserted: List[Dict[str, Any]] = []
+        for role, content in (("user", question), ("assistant", message)):
+            cursor = conn.execute(INSERT_MESSAGE_SQL, (session_id, role, content, now))
+            inserted.append(
+                {
+                    "id": cursor.lastrowid,
+                    "role": role,
+                    "content": content,
+                    "created_at": now,
+                    "previous_id": previous_id,
+                }
+            )
+            previous_id = cursor.lastrowid
+        return inserted
+
+    def _schema_version(self, conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()
+        return int(row[0])
+
+    def _apply_migration(self, conn: sqlite3.Connection, version: int, script: str) -> None:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker may have migrated between our version check and the lock.
+            applied = conn.execute(
+                "SELECT 1 FROM schema_version WHERE version = ?", (version,)
+            ).fetchone()
+            if not applied:
+                for statement in _split_statements(script):
+                    conn.execute(statement)
+                conn.execute(
+                    "INSERT INTO schema_version (version, applied_at) VALUES (?, ?)",
+                    (version, _utc_now()),
+                )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _writer_connection(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError("Storage is closed")
+        if self._writer is None:
+            self._writer = self._connect()
+            self._writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._writer.execute("PRAGMA journal_mode=WAL")
+        return self._writer
+
+    @contextmanager
+    def _read(self) -> Iterator[sqlite3.Connection]:
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            self._release_reader(conn)
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError("Storage is closed")
+        try:
+            return self._idle_readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._reader_lock:
+            if self._reader_count < self.readers:
+                self._reader_count += 1
+                return self._connect()
+        try:
+            return self._idle_readers.get(timeout=self.busy_timeout_ms / 1000)
+        except queue.Empty as exc:
+            raise TimeoutError("Timed out waiting for a pooled reader connection") from exc
+
+    def _release_reader(self, conn: sqlite3.Connection) -> None:
+        if self._closed:
+            conn.close()
+            with self._reader_lock:
+                self._reader_count -= 1
+            return
+        self._idle_readers.put(conn)
+
     def _connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
         conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size={-int(self.cache_size_kb)}")
         return conn
 
 
+def _reading_row(
+    session_id: str,
+    tool: str,
+    symbols: List[Dict[str, Any]],
+    verdict: str,
+    advice: List[str],
+    created_at: str,
+) -> Tuple[str, str, str, str, str, str]:
+    return (
+        session_id,
+        tool,
+        json.dumps(symbols, ensure_ascii=False),
+        verdict,
+        json.dumps(advice, ensure_ascii=False),
+        created_at,
+    )
+
+
+def _trace_row(
+    session_id: str, trace: List[Dict[str, Any]], created_at: str
+) -> Tuple[str, bytes, str, str]:
+    return (session_id, encode_trace(trace), DELTA_ZLIB_CODEC, created_at)
+
+
+def _usage_rows(
+    session_id: str, usage: Iterable[Dict[str, Any]], created_at: str
+) -> List[Tuple[Any, ...]]:
+    return [
+        (
+            session_id,
+            item.get("node", ""),
+            item.get("provider", ""),
+            item.get("model", ""),
+            int(item.get("prompt_tokens") or 0),
+            int(item.get("completion_tokens") or 0),
+            float(item.get("cost_usd") or 0.0),
+            1 if item.get("cached") else 0,
+            1 if item.get("estimated") else 0,
+            created_at,
+        )
+        for item in usage
+    ]
+
+
+def _reading_from_row(row: sqlite3.Row) -> Dict[str, Any]:
+    record = dict(row)
+    record["symbols"] = json.loads(record["symbols"])
+    record["advice"] = json.loads(record["advice"])
+    return record
+
+
+def _export_record(record_type: str, row: sqlite3.Row) -> Dict[str, Any]:
+    if record_type == "reading":
+        record = _reading_from_row(row)
+    elif record_type == "trace":
+        record = {
+            "id": row["id"],
+            "session_id": row["session_id"],
+            "trace": decode_trace_row(row["trace"], row["payload"], row["codec"]),
+            "created_at": row["created_at"],
+        }
+    else:
+        record = dict(row)
+    return {"type": record_type, **record}
+
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _split_statements(script: str) -> List[str]:
+    statements: List[str] = []
+    pending = ""
+    for line in script.splitlines(keepends=True):
+        pending += line
+        if sqlite3.complete_statement(pending):
+            statement = pending.strip()
+            if statement.rstrip(";").strip():
+                statements.append(statement)
+            pending = ""
+    if pending.strip():
+        statements.append(pending.strip())
+    return statements
+
+
 def _utc_now() -> str:
     return datetime.now(timezone.utc).isoformat()
 
@@ -161,3 +932,24 @@ def _file_is_writable(path: str) -> bool:
     if not os.path.exists(path):
         return True
     return os.access(path, os.W_OK)
+
+
+def _normalize_synchronous(value: str) -> str:
+    mode = value.strip().upper()
+    return mode if mode in SYNCHRONOUS_MODES else "NORMAL"
+
+
+def _get_synchronous() -> str:
+    return os.getenv("ORACLE_CHOICE_DB_SYNCHRONOUS", "NORMAL")
+
+
+def _get_readers() -> int:
+    return env_int("ORACLE_CHOICE_DB_READERS", 4, minimum=1)
+
+
+def _get_busy_timeout_ms() -> int:
+    return env_int("ORACLE_CHOICE_DB_BUSY_TIMEOUT_MS", 5000, minimum=0)
+
+
+def _get_cache_size_kb() -> int:
+    return env_int("ORACLE_CHOICE_DB_CACHE_KB", 8192, minimum=0)
@@ -0,0 +1,143 @@
+﻿from __future__ import annotations
+
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+
+@dataclass
+class CachedHistory:
+    messages: Deque[Dict[str, Any]]
+    complete: bool
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def last_id(self) -> int:
+        return int(self.messages[-1]["id"]) if self.messages else 0
+
+
+class HistoryCache:
+    def __init__(self, max_sessions: int = 1024, depth: int = 20, ttl: float = 900.0) -> None:
+        self.max_sessions = max_sessions
+        self.depth = depth
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, CachedHistory]" = OrderedDict()
+        self._loading: Dict[str, int] = {}
+        self._writes: Dict[str, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_loads = 0
+        self.gaps = 0
+
+    def get(self, session_id: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        entry = self._entries.get(session_id)
+        now = time.monotonic()
+        # Expiry counts from the load, not the last use, so an entry that
+        # missed writes from another process is reloaded within the TTL.
+        if entry is not None and now - entry.loaded_at > self.ttl:
+            del self._entries[session_id]
+            self.expirations += 1
+            entry = None
+        if entry is None or (limit > len(entry.messages) and not entry.complete):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(session_id)
+        messages = list(entry.messages)[-limit:] if limit > 0 else []
+        return [dict(message) for message in messages]
+
+    def begin_load(self, session_id: str) -> int:
+        self._loading[session_id] = self._loading.get(session_id, 0) + 1
+        return self._writes.get(session_id, 0)
+
+    def finish_load(
+        self,
+        session_id: str,
+        token: int,
+        messages: Optional[List[Dict[str, Any]]],
+        requested: int,
+    ) -> None:
+        written = self._writes.get(session_id, 0)
+        pending = self._loading.get(session_id, 1) - 1
+        if pending:
+            self._loading[session_id] = pending
+        else:
+            self._loading.pop(session_id, None)
+            self._writes.pop(session_id, None)
+
+        if messages is None:
+            return
+        if written != token:
+            # A write-through raced with this read and found no entry to
+            # update, so these rows may already be missing a message.
+            self.stale_loads += 1
+            return
+
+        self._entries[session_id] = CachedHistory(
+            messages=deque((_cached(message) for message in messages), maxlen=self.depth),
+            complete=len(messages) < requested,
+        )
+        self._entries.move_to_end(session_id)
+        self._evict()
+
+    def append(self, session_id: str, messages: List[Dict[str, Any]]) -> None:
+        if session_id in self._loading:
+            self._writes[session_id] = self._writes.get(session_id, 0) + 1
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        for message in messages:
+            if int(message["id"]) <= entry.last_id:
+                continue
+            if message.get("previous_id", entry.last_id) != entry.last_id:
+                # Someone else wrote to this session in between; reload it
+                # rather than splice a history with holes in it.
+                del self._entries[session_id]
+                self.gaps += 1
+                return
+            if len(entry.messages) == self.depth:
+                entry.complete = False
+            entry.messages.append(_cached(message))
+        self._entries.move_to_end(session_id)
+
+    def invalidate(self, session_id: str) -> None:
+        if session_id in self._loading:
+            self._writes[session_id] = self._writes.get(session_id, 0) + 1
+        self._entries.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._entries),
+            "capacity": self.max_sessions,
+            "depth": self.depth,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale_loads": self.stale_loads,
+            "gaps": self.gaps,
+        }
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            if now - entry.loaded_at > self.ttl:
+                del self._entries[session_id]
+                self.expirations += 1
+            elif len(self._entries) > self.max_sessions:
+                del self._entries[session_id]
+                self.evictions += 1
+            else:
+                break
+
+
+def _cached(message: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in message.items() if key != "previous_id"}
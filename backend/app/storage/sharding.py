@@ -0,0 +1,262 @@
+﻿from __future__ import annotations
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from ..env import env_int
+from .db import Storage, _default_db_path, _utc_now
+
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+HASH_NAME = "blake2b-64"
+# Row ids are namespaced per shard so they stay unique across the fleet;
+# shard N allocates from N * SHARD_ID_STRIDE.
+SHARD_ID_STRIDE = 1 << 40
+
+
+class ShardedStorage:
+    def __init__(self, directory: str, shards: int, **storage_kwargs: Any) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = load_manifest(directory, shards)
+        self.shards = [
+            Storage(os.path.join(directory, name), **storage_kwargs)
+            for name in self.manifest["shards"]
+        ]
+        for index, shard in enumerate(self.shards):
+            shard.reserve_ids(index * SHARD_ID_STRIDE)
+        self.readers = sum(shard.readers for shard in self.shards)
+        self.trace_max_age_days = self.shards[0].trace_max_age_days
+        self.trace_max_per_session = self.shards[0].trace_max_per_session
+
+    def shard_for(self, session_id: str) -> Storage:
+        return self.shards[shard_index(session_id, len(self.shards))]
+
+    def init(self) -> None:
+        for shard in self.shards:
+            shard.init()
+
+    def schema_version(self) -> int:
+        return min(shard.schema_version() for shard in self.shards)
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
+
+    def upsert_session(self, session_id: str) -> None:
+        self.shard_for(session_id).upsert_session(session_id)
+
+    def add_message(self, session_id: str, role: str, content: str) -> None:
+        self.shard_for(session_id).add_message(session_id, role, content)
+
+    def add_reading(
+        self,
+        session_id: str,
+        tool: str,
+        symbols: List[Dict[str, Any]],
+        verdict: str,
+        advice: List[str],
+    ) -> None:
+        self.shard_for(session_id).add_reading(session_id, tool, symbols, verdict, advice)
+
+    def add_trace(self, session_id: str, trace: List[Dict[str, Any]]) -> None:
+        self.shard_for(session_id).add_trace(session_id, trace)
+
+    def record_turn(
+        self,
+        session_id: str,
+        question: str,
+        message: str,
+        tool: str,
+        symbols: List[Dict[str, Any]],
+        verdict: str,
+        advice: List[str],
+        trace: List[Dict[str, Any]],
+        usage: Sequence[Dict[str, Any]] = (),
+    ) -> List[Dict[str, Any]]:
+        return self.shard_for(session_id).record_turn(
+            session_id, question, message, tool, symbols, verdict, advice, trace, usage
+        )
+
+    def record_conversation(
+        self, session_id: str, question: str, message: str
+    ) -> List[Dict[str, Any]]:
+        return self.shard_for(session_id).record_conversation(session_id, question, message)
+
+    def record_artifacts(self, turns: List[Dict[str, Any]]) -> None:
+        for index, group in _group_by_shard(turns, "session_id", len(self.shards)).items():
+            self.shards[index].record_artifacts(group)
+
+    def get_recent_messages(self, session_id: str, limit: int = 5) -> List[Dict[str, Any]]:
+        return self.shard_for(session_id).get_recent_messages(session_id, limit)
+
+    def get_traces(self, session_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        return self.shard_for(session_id).get_traces(session_id, limit)
+
+    def list_messages(
+        self, session_id: str, after_id: int = 0, limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        return self.shard_for(session_id).list_messages(session_id, after_id, limit)
+
+    def list_readings(
+        self, session_id: str, after_id: int = 0, limit: int = 50
+    ) -> List[Dict[str, Any]]:
+        return self.shard_for(session_id).list_readings(session_id, after_id, limit)
+
+    def add_usage(self, session_id: str, usage: Sequence[Dict[str, Any]]) -> None:
+        self.shard_for(session_id).add_usage(session_id, usage)
+
+    def get_usage(self, session_id: str | None = None) -> List[Dict[str, Any]]:
+        if session_id:
+            return self.shard_for(session_id).get_usage(session_id)
+        return [row for shard in self.shards for row in shard.get_usage()]
+
+    def get_usage_by_session(self, limit: int = 20) -> List[Dict[str, Any]]:
+        rows = [row for shard in self.shards for row in shard.get_usage_by_session(limit)]
+        rows.sort(key=lambda row: (row["cost_usd"], row["calls"]), reverse=True)
+        return rows[:limit]
+
+    def get_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self.shard_for(session_id).get_summary(session_id)
+
+    def save_summary(self, session_id: str, summary: str, through_message_id: int) -> bool:
+        return self.shard_for(session_id).save_summary(session_id, summary, through_message_id)
+
+    def search(
+        self, query: str, kind: str | None = None, limit: int = 20, offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        # bm25 statistics are per shard, so merged scores only approximate a
+        # global ranking; the order within each shard is exact.
+        candidates: List[Dict[str, Any]] = []
+        for index, shard in enumerate(self.shards):
+            for item in shard.search(query, kind=kind, limit=offset + limit):
+                item["shard"] = index
+                candidates.append(item)
+        if any(item["score"] is not None for item in candidates):
+            candidates.sort(key=lambda item: item["score"])
+        else:
+            candidates.sort(key=lambda item: item["created_at"], reverse=True)
+        return candidates[offset : offset + limit]
+
+    def backfill_search_index(self, batch_size: int = 5000) -> Dict[str, int]:
+        indexed: Dict[str, int] = {}
+        for shard in self.shards:
+            for table, count in shard.backfill_search_index(batch_size).items():
+                indexed[table] = indexed.get(table, 0) + count
+        return indexed
+
+    def iter_export(self, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        for index, shard in enumerate(self.shards):
+            for record in shard.iter_export(batch_size):
+                record["shard"] = index
+                yield record
+
+    def import_rows(
+        self, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]
+    ) -> int:
+        key = "id" if table == "sessions" else "session_id"
+        position = list(columns).index(key)
+        grouped: Dict[int, List[Sequence[Any]]] = {}
+        for row in rows:
+            grouped.setdefault(shard_index(row[position], len(self.shards)), []).append(row)
+        for index, group in grouped.items():
+            self.shards[index].import_rows(
+                table, columns, _offset_ids(table, columns, group, index * SHARD_ID_STRIDE)
+            )
+        return sum(len(group) for group in grouped.values())
+
+    def prune_traces(self) -> int:
+        return sum(shard.prune_traces() for shard in self.shards)
+
+    def compact(self, max_pages: int = 0, full: bool = False) -> Dict[str, Any]:
+        return {
+            "shards": [shard.compact(max_pages, full) for shard in self.shards],
+        }
+
+    def run_maintenance(self) -> Dict[str, Any]:
+        results = [shard.run_maintenance() for shard in self.shards]
+        return {
+            "pruned_traces": sum(result["pruned_traces"] for result in results),
+            "shards": results,
+            "started_at": results[0]["started_at"],
+            "ended_at": results[-1]["ended_at"],
+        }
+
+
+def _offset_ids(
+    table: str, columns: Sequence[str], rows: List[Sequence[Any]], offset: int
+) -> List[Sequence[Any]]:
+    # Imported ids move into the target shard's range; summaries point at
+    # message ids, so their watermark moves with them.
+    id_columns = {"through_message_id"} if table == "session_summaries" else {"id"}
+    positions = [i for i, name in enumerate(columns) if name in id_columns]
+    if table == "sessions" or not offset or not positions:
+        return rows
+    shifted = []
+    for row in rows:
+        values = list(row)
+        for i in positions:
+            values[i] += offset
+        shifted.append(values)
+    return shifted
+
+
+def shard_index(session_id: str, shard_count: int) -> int:
+    digest = hashlib.blake2b(session_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+def load_manifest(directory: str, shards: int) -> Dict[str, Any]:
+    path = os.path.join(directory, MANIFEST_NAME)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "hash": HASH_NAME,
+        "shard_count": shards,
+        "shards": [f"shard-{index:03d}.db" for index in range(shards)],
+        "created_at": _utc_now(),
+    }
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle, indent=2)
+    try:
+        os.link(temp_path, path)
+        return manifest
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(temp_path)
+
+    with open(path, "r", encoding="utf-8") as handle:
+        existing = json.load(handle)
+    if existing.get("shard_count") != shards or existing.get("hash") != HASH_NAME:
+        raise ValueError(
+            f"Shard manifest {path} describes {existing.get('shard_count')} shards, "
+            f"but {shards} were requested; rebalance with scripts/rebalance_shards.py"
+        )
+    return existing
+
+
+def create_storage() -> Storage | ShardedStorage:
+    shards = env_int("ORACLE_CHOICE_DB_SHARDS", 1, minimum=1)
+    if shards == 1:
+        return Storage()
+    return ShardedStorage(_default_shard_dir(), shards)
+
+
+def _default_shard_dir() -> str:
+    env_dir = os.getenv("ORACLE_CHOICE_DB_SHARD_DIR")
+    if env_dir:
+        return env_dir
+    return os.path.join(os.path.dirname(_default_db_path()), "oracle_choice_shards")
+
+
+def _group_by_shard(
+    items: List[Dict[str, Any]], key: str, shard_count: int
+) -> Dict[int, List[Dict[str, Any]]]:
+    grouped: Dict[int, List[Dict[str, Any]]] = {}
+    for item in items:
+        grouped.setdefault(shard_index(item[key], shard_count), []).append(item)
+    return grouped
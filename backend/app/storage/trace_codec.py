@@ -0,0 +1,128 @@
+﻿from __future__ import annotations
+
+import json
+import zlib
+from typing import Any, Dict, List, Optional
+
+
+JSON_CODEC = "json"
+DELTA_ZLIB_CODEC = "delta-zlib"
+FORMAT_VERSION = 1
+
+_MISSING = object()
+
+
+def encode_trace(trace: List[Dict[str, Any]]) -> bytes:
+    events: List[Dict[str, Any]] = []
+    expected: Dict[str, Any] = {}
+    for event in trace:
+        encoded = {key: value for key, value in event.items() if key not in {"input", "output"}}
+        node_input = event.get("input", _MISSING)
+        node_output = event.get("output", _MISSING)
+
+        if isinstance(node_input, dict):
+            encoded["i"] = _diff(expected, node_input)
+            expected = dict(node_input)
+        elif node_input is not _MISSING:
+            encoded["ri"] = node_input
+
+        if isinstance(node_output, dict) and isinstance(node_input, dict):
+            encoded["o"] = _diff_sparse(node_input, node_output)
+        elif node_output is not _MISSING:
+            encoded["ro"] = node_output
+
+        if isinstance(node_output, dict):
+            expected.update(node_output)
+        events.append(encoded)
+
+    document = {"v": FORMAT_VERSION, "events": events}
+    raw = json.dumps(document, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(raw.encode("utf-8"), 6)
+
+
+def decode_trace(payload: bytes) -> List[Dict[str, Any]]:
+    document = json.loads(zlib.decompress(payload).decode("utf-8"))
+    trace: List[Dict[str, Any]] = []
+    expected: Dict[str, Any] = {}
+    for encoded in document.get("events", []):
+        event = {
+            key: value for key, value in encoded.items() if key not in {"i", "o", "ri", "ro"}
+        }
+        node_input: Any = _MISSING
+        if "i" in encoded:
+            node_input = _apply(expected, encoded["i"])
+            expected = dict(node_input)
+        elif "ri" in encoded:
+            node_input = encoded["ri"]
+
+        node_output: Any = _MISSING
+        if "o" in encoded:
+            node_output = _apply_sparse(node_input, encoded["o"])
+        elif "ro" in encoded:
+            node_output = encoded["ro"]
+
+        if node_input is not _MISSING:
+            event["input"] = node_input
+        if node_output is not _MISSING:
+            event["output"] = node_output
+            if isinstance(node_output, dict):
+                expected.update(node_output)
+        trace.append(event)
+    return trace
+
+
+def decode_trace_row(
+    trace: Optional[str], payload: Optional[bytes], codec: Optional[str]
+) -> List[Dict[str, Any]]:
+    if codec == DELTA_ZLIB_CODEC and payload is not None:
+        return decode_trace(payload)
+    return json.loads(trace or "[]")
+
+
+def _same(a: Any, b: Any) -> bool:
+    # Plain == treats 1, 1.0 and True as equal, which would let a delta
+    # decode to a value of the wrong type.
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same(a[key], b[key]) for key in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _diff(base: Dict[str, Any], target: Dict[str, Any]) -> Dict[str, Any]:
+    delta: Dict[str, Any] = {}
+    changed = {
+        key: value for key, value in target.items() if not _same(base.get(key, _MISSING), value)
+    }
+    removed = [key for key in base if key not in target]
+    if changed:
+        delta["set"] = changed
+    if removed:
+        delta["del"] = removed
+    return delta
+
+
+def _apply(base: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    removed = set(delta.get("del", []))
+    result = {key: value for key, value in base.items() if key not in removed}
+    result.update(delta.get("set", {}))
+    return result
+
+
+def _diff_sparse(base: Dict[str, Any], target: Dict[str, Any]) -> Dict[str, Any]:
+    delta: Dict[str, Any] = {}
+    same = [key for key, value in target.items() if _same(base.get(key, _MISSING), value)]
+    changed = {key: value for key, value in target.items() if key not in same}
+    if changed:
+        delta["set"] = changed
+    if same:
+        delta["same"] = same
+    return delta
+
+
+def _apply_sparse(base: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    result = {key: base.get(key) for key in delta.get("same", [])}
+    result.update(delta.get("set", {}))
+    return result
@@ -0,0 +1,159 @@
+﻿from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+FlushFn = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    def __init__(
+        self,
+        flush: FlushFn,
+        max_size: int = 1000,
+        batch_size: int = 100,
+        put_timeout: float = 0.1,
+        retries: int = 3,
+        retry_backoff: float = 0.05,
+    ) -> None:
+        self._flush = flush
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.enqueued = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.retried = 0
+        self.dropped = 0
+        self.backpressure_waits = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self.last_error: Optional[str] = None
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._task = asyncio.create_task(self._drain())
+
+    async def put(self, item: Dict[str, Any]) -> bool:
+        self.start()
+        assert self._queue is not None
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.backpressure_waits += 1
+            try:
+                await asyncio.wait_for(self._queue.put(item), timeout=self.put_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                return False
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    async def flush(self) -> None:
+        if self._queue is not None and self._task is not None:
+            await self._queue.join()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "capacity": self.max_size,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "backpressure_waits": self.backpressure_waits,
+            "rejected": self.rejected,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / self.batches, 3) if self.batches else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "last_error": self.last_error,
+        }
+
+    async def _drain(self) -> None:
+        assert self._queue is not None
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            started = time.perf_counter()
+            try:
+                if await self._flush_with_retry(batch, self.retries):
+                    self.flushed += len(batch)
+                else:
+                    self.failed_batches += 1
+                    # Write turns one by one so a single bad turn does not
+                    # take the rest of the batch down with it.
+                    for item in batch:
+                        if len(batch) > 1 and await self._flush_with_retry([item], 0):
+                            self.flushed += 1
+                        else:
+                            self._drop(item)
+            finally:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self.batches += 1
+                self.last_flush_ms = elapsed_ms
+                self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+                self._total_flush_ms += elapsed_ms
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush_with_retry(self, batch: List[Dict[str, Any]], retries: int) -> bool:
+        for attempt in range(retries + 1):
+            if attempt:
+                self.retried += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                await self._flush(batch)
+                return True
+            except Exception as exc:
+                self.last_error = str(exc)
+                logger.warning(
+                    "write-behind flush of %d turns failed (attempt %d/%d)",
+                    len(batch),
+                    attempt + 1,
+                    retries + 1,
+                    exc_info=exc,
+                )
+        return False
+
+    def _drop(self, item: Dict[str, Any]) -> None:
+        self.dropped += 1
+        logger.error("write-behind dropped artifacts for session %s", item.get("session_id"))
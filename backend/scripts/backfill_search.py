@@ -0,0 +1,33 @@
+﻿from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.storage.sharding import create_storage  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Index existing messages and readings for GET /search."
+    )
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    storage = create_storage()
+    started = time.perf_counter()
+    try:
+        indexed = storage.backfill_search_index(args.batch_size)
+    finally:
+        storage.close()
+
+    for table, count in indexed.items():
+        print(f"[{table}] indexed={count}")
+    print(f"elapsed={time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+﻿from __future__ import annotations
+
+import argparse
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.agent.nodes import classify_question  # noqa: E402
+from app.storage.db import Storage  # noqa: E402
+from app.storage.sharding import create_storage  # noqa: E402
+
+
+FIELDS = ["intent", "domain", "tone", "need_clarification", "tool"]
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0]
+
+
+def llm_sample(trace: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    events = {event.get("node"): event for event in trace}
+    parse = events.get("parse")
+    if not parse:
+        return None
+    output = parse.get("output") or {}
+    if output.get("classifier") == "rules" or not output.get("llm_provider"):
+        return None
+    node_input = parse.get("input") or {}
+    sample = {field: output.get(field) for field in FIELDS if field != "tool"}
+    route_output = (events.get("route") or {}).get("output") or {}
+    sample["tool"] = route_output.get("tool")
+    # None when the trace was recorded without its input.
+    sample["question"] = node_input.get("question")
+    sample["force_divination"] = bool(node_input.get("force_divination"))
+    return sample
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure how often the rule classifier agrees with stored LLM decisions."
+    )
+    parser.add_argument("--db", help="single-file database (defaults to the configured storage)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--show-disagreements", type=int, default=0)
+    args = parser.parse_args()
+
+    storage = Storage(args.db) if args.db else create_storage()
+    samples: List[Dict[str, Any]] = []
+    no_input = 0
+    try:
+        for record in storage.iter_export(args.batch_size):
+            if record["type"] != "trace":
+                continue
+            sample = llm_sample(record["trace"])
+            if sample is None:
+                continue
+            if sample["question"] is None:
+                no_input += 1
+                continue
+            samples.append(sample)
+    finally:
+        storage.close()
+
+    if no_input:
+        print(f"skipped {no_input} LLM-classified traces recorded without the question")
+    if not samples:
+        print("No LLM-classified traces found.")
+        return
+
+    field_matches = {field: 0 for field in FIELDS}
+    rows = []
+    for sample in samples:
+        rules = classify_question(sample["question"], sample["force_divination"])
+        matched = {field: rules[field] == sample[field] for field in FIELDS}
+        for field, ok in matched.items():
+            field_matches[field] += int(ok)
+        rows.append((rules["confidence"], all(matched.values()), sample, rules))
+
+    total = len(rows)
+    print(f"samples={total}")
+    for field in FIELDS:
+        print(f"  {field:<20} agreement={field_matches[field] / total:.3f}")
+    print(f"  {'all fields':<20} agreement={sum(row[1] for row in rows) / total:.3f}")
+
+    print("threshold  skipped  skip_rate  agreement_when_skipped")
+    for threshold in THRESHOLDS:
+        skipped = [row for row in rows if row[0] >= threshold]
+        agreement = sum(row[1] for row in skipped) / len(skipped) if skipped else 0.0
+        print(f"{threshold:>9.2f}  {len(skipped):>7}  {len(skipped) / total:>9.3f}  {agreement:>22.3f}")
+
+    shown = 0
+    for confidence, agreed, sample, rules in sorted(rows, key=lambda row: -row[0]):
+        if shown >= args.show_disagreements:
+            break
+        if agreed:
+            continue
+        shown += 1
+        diff = {field: (rules[field], sample[field]) for field in FIELDS if rules[field] != sample[field]}
+        print(f"[{confidence:.2f}] {sample['question']!r} rules/llm={diff}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+﻿from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.storage.db import Storage  # noqa: E402
+from app.storage.sharding import create_storage  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Reclaim free pages offline. Files created before incremental auto_vacuum "
+            "get a one-time full VACUUM; stop the server first, it blocks all writes."
+        )
+    )
+    parser.add_argument("--db", help="single-file database (defaults to the configured storage)")
+    args = parser.parse_args()
+
+    storage = Storage(args.db) if args.db else create_storage()
+    started = time.perf_counter()
+    try:
+        result = storage.compact(full=True)
+    finally:
+        storage.close()
+
+    print(json.dumps(result))
+    print(f"elapsed={time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+﻿from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from typing import List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.storage.db import SCHEMA, Storage  # noqa: E402
+
+
+FULL_SCAN_SQL = """
+SELECT role, content, created_at
+FROM messages NOT INDEXED
+WHERE session_id = ?
+ORDER BY id DESC
+LIMIT ?
+"""
+
+
+def upgrade_legacy_file(db_path: str) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    conn.execute(
+        "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+        ("legacy", "user", "你好", "2024-01-01T00:00:00+00:00"),
+    )
+    conn.commit()
+    conn.close()
+
+    storage = Storage(db_path)
+    indexes = [
+        row[0]
+        for row in sqlite3.connect(db_path).execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'"
+        )
+    ]
+    history = storage.get_recent_messages("legacy")
+    print(f"[migrate] schema_version={storage.schema_version()} indexes={indexes}")
+    print(f"[migrate] legacy history preserved={len(history) == 1}")
+    storage.close()
+
+
+def fill_messages(db_path: str, start: int, stop: int, sessions: int) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous=OFF")
+    batch = 50_000
+    for offset in range(start, stop, batch):
+        rows = [
+            (f"s{i % sessions}", "user" if i % 2 == 0 else "assistant", f"message {i}", "now")
+            for i in range(offset, min(offset + batch, stop))
+        ]
+        conn.executemany(
+            "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+    conn.close()
+
+
+def time_lookups(lookup, sessions: int, samples: int) -> float:
+    timings: List[float] = []
+    step = max(sessions // samples, 1)
+    for index in range(samples):
+        session_id = f"s{(index * step) % sessions}"
+        started = time.perf_counter()
+        lookup(session_id)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark per-session history lookups.")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--sessions", type=int, default=10_000)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--scan-samples", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        upgrade_legacy_file(os.path.join(tmp_dir, "legacy.db"))
+
+        db_path = os.path.join(tmp_dir, "history.db")
+        storage = Storage(db_path)
+        scan_conn = sqlite3.connect(db_path)
+        filled = 0
+        for size in sorted(args.sizes):
+            fill_messages(db_path, filled, size, args.sessions)
+            filled = size
+
+            indexed = time_lookups(
+                lambda session_id: storage.get_recent_messages(session_id, limit=5),
+                args.sessions,
+                args.samples,
+            )
+            scanned = time_lookups(
+                lambda session_id: scan_conn.execute(FULL_SCAN_SQL, (session_id, 5)).fetchall(),
+                args.sessions,
+                args.scan_samples,
+            )
+            print(
+                f"[history] messages={size} indexed_median={indexed:.3f}ms "
+                f"full_scan_median={scanned:.3f}ms"
+            )
+        scan_conn.close()
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+﻿from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import string
+import sys
+from typing import Any, List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.agent.json_stream import JsonFieldStream, extract_json  # noqa: E402
+
+
+ALPHABET = string.ascii_letters + string.digits + ' "\\/{}[]:,\n\t' + "塔罗六爻雷诺曼😀"
+
+
+def random_text(rng: random.Random, limit: int = 40) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, limit)))
+
+
+def random_value(rng: random.Random, depth: int = 0) -> Any:
+    kind = rng.randint(0, 6 if depth < 3 else 3)
+    if kind == 0:
+        return random_text(rng)
+    if kind == 1:
+        return rng.randint(-1000, 1000)
+    if kind == 2:
+        return rng.choice([True, False, None])
+    if kind == 3:
+        return rng.random()
+    if kind == 4:
+        return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {random_text(rng, 8): random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))}
+
+
+def random_document(rng: random.Random) -> dict:
+    document = {random_text(rng, 8): random_value(rng, 1) for _ in range(rng.randint(0, 3))}
+    document["message"] = random_text(rng, 200)
+    items = list(document.items())
+    rng.shuffle(items)
+    return dict(items)
+
+
+def wrap(rng: random.Random, body: str) -> str:
+    style = rng.randint(0, 3)
+    if style == 0:
+        return body
+    if style == 1:
+        return f"```json\n{body}\n```"
+    if style == 2:
+        return f"Here is the JSON:\n{body}\nHope it helps."
+    return f"  \n{body}  "
+
+
+def split(rng: random.Random, text: str) -> List[str]:
+    chunks: List[str] = []
+    index = 0
+    while index < len(text):
+        size = rng.randint(1, 12)
+        chunks.append(text[index : index + size])
+        index += size
+    return chunks
+
+
+def stream(text: str, chunks: List[str]) -> JsonFieldStream:
+    parser = JsonFieldStream(["message"])
+    streamed = ""
+    for chunk in chunks:
+        for field, delta in parser.feed(chunk):
+            assert field == "message"
+            streamed += delta
+    assert streamed == parser.values.get("message", ""), (text, streamed)
+    return parser
+
+
+def check_valid(rng: random.Random) -> None:
+    document = random_document(rng)
+    body = json.dumps(document, ensure_ascii=rng.random() < 0.5, indent=rng.choice([None, 2]))
+    text = wrap(rng, body)
+    parser = stream(text, split(rng, text))
+    result = parser.close()
+    assert result == document, (text, result)
+    assert parser.values["message"] == document["message"], text
+    assert extract_json(text) == document, text
+
+
+def check_truncated(rng: random.Random) -> None:
+    document = random_document(rng)
+    body = json.dumps(document, ensure_ascii=rng.random() < 0.5)
+    text = wrap(rng, body)[: rng.randint(0, len(body))]
+    parser = stream(text, split(rng, text))
+    partial = parser.values.get("message", "")
+    assert document["message"].startswith(partial), (text, partial)
+    result = parser.close()
+    assert result is None or result == document, (text, result)
+
+
+def check_malformed(rng: random.Random) -> None:
+    body = json.dumps(random_document(rng))
+    chars = list(wrap(rng, body))
+    for _ in range(rng.randint(1, 5)):
+        position = rng.randrange(len(chars) + 1)
+        action = rng.randint(0, 2)
+        if action == 0 and chars:
+            del chars[min(position, len(chars) - 1)]
+        elif action == 1:
+            chars.insert(position, rng.choice('{}[]":,\\'))
+        elif chars:
+            chars[min(position, len(chars) - 1)] = rng.choice(ALPHABET)
+    text = "".join(chars)
+    parser = stream(text, split(rng, text))
+    result = parser.close()
+    assert result is None or isinstance(result, dict), (text, result)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fuzz the incremental JSON field extractor.")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    checks = [check_valid, check_truncated, check_malformed]
+    for check in checks:
+        for _ in range(args.iterations):
+            check(rng)
+        print(f"[{check.__name__}] {args.iterations} cases ok")
+
+
+if __name__ == "__main__":
+    main()
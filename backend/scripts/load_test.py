@@ -0,0 +1,174 @@
+﻿from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+QUESTIONS = [
+    "我想占卜一下这次面试能过吗",
+    "帮我用塔罗看看我和他的感情走向",
+    "最近工作压力很大，心里很乱",
+    "用六爻算一下我该不该换工作",
+    "雷诺曼看看这个月的财运",
+    "今天有点难过，想找人聊聊",
+]
+
+
+def percentile(values: List[float], quantile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(quantile * (len(ordered) - 1)))]
+
+
+async def chat_once(
+    client: httpx.AsyncClient, session_id: str, question: str, stream: bool
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    body = {"session_id": session_id, "message": question}
+    if not stream:
+        response = await client.post("/chat", json=body)
+        return {"status": response.status_code, "latency": time.perf_counter() - started}
+
+    ttft: Optional[float] = None
+    async with client.stream("POST", "/chat/stream", json=body) as response:
+        async for line in response.aiter_lines():
+            if ttft is None and line.startswith("event: token"):
+                ttft = time.perf_counter() - started
+    latency = time.perf_counter() - started
+    return {"status": response.status_code, "latency": latency, "ttft": ttft}
+
+
+async def run(args: argparse.Namespace, client: httpx.AsyncClient) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    jobs = [
+        (f"load-{rng.randrange(args.sessions)}", rng.choice(QUESTIONS))
+        for _ in range(args.requests)
+    ]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results: List[Dict[str, Any]] = []
+
+    async def worker(session_id: str, question: str) -> None:
+        async with semaphore:
+            try:
+                results.append(await chat_once(client, session_id, question, args.stream))
+            except httpx.HTTPError as exc:
+                results.append({"status": type(exc).__name__, "latency": 0.0})
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(session_id, question) for session_id, question in jobs))
+    elapsed = time.perf_counter() - started
+
+    latencies = [item["latency"] for item in results if item["status"] == 200]
+    ttfts = [item["ttft"] for item in results if item.get("ttft") is not None]
+    headers = {"Authorization": f"Bearer {args.ops_token}"} if args.ops_token else {}
+    response = await client.get("/metrics", headers=headers)
+    metrics = response.json() if response.status_code == 200 else {}
+    return {
+        "elapsed": elapsed,
+        "statuses": Counter(str(item["status"]) for item in results),
+        "latencies": latencies,
+        "ttfts": ttfts,
+        "metrics": metrics,
+    }
+
+
+def report(args: argparse.Namespace, summary: Dict[str, Any]) -> None:
+    latencies = summary["latencies"]
+    print(
+        f"[load] requests={args.requests} concurrency={args.concurrency} "
+        f"stream={args.stream} elapsed={summary['elapsed']:.2f}s "
+        f"throughput={args.requests / summary['elapsed']:.1f}/s"
+    )
+    print(f"[load] statuses={dict(summary['statuses'])}")
+    if latencies:
+        print(
+            f"[latency] mean={statistics.mean(latencies) * 1000:.1f}ms "
+            f"p50={percentile(latencies, 0.5) * 1000:.1f}ms "
+            f"p95={percentile(latencies, 0.95) * 1000:.1f}ms "
+            f"p99={percentile(latencies, 0.99) * 1000:.1f}ms"
+        )
+    if summary["ttfts"] and not args.url:
+        # httpx's ASGI transport buffers the body, so TTFT needs a real server.
+        print("[ttft] skipped in process; pass --url to measure time to first token")
+    elif summary["ttfts"]:
+        ttfts = summary["ttfts"]
+        print(
+            f"[ttft] p50={percentile(ttfts, 0.5) * 1000:.1f}ms "
+            f"p95={percentile(ttfts, 0.95) * 1000:.1f}ms"
+        )
+    llm = summary["metrics"].get("llm", {})
+    for provider, stats in (llm.get("concurrency") or {}).items():
+        print(
+            f"[limiter] {provider} limit={stats['limit']} "
+            f"max_queue_depth={stats['max_queue_depth']} rejected={stats['rejected']} timeouts={stats['timeouts']}"
+        )
+    if llm.get("stub"):
+        print(f"[stub] {json.dumps(llm['stub'])}")
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    timeout = httpx.Timeout(args.timeout)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as client:
+            report(args, await run(args, client))
+        return
+
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://load-test", timeout=timeout
+        ) as client:
+            report(args, await run(args, client))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Drive /chat end to end, in process against the stub LLM or against --url."
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--stream", action="store_true", help="use /chat/stream and report TTFT")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--url", help="target a running server instead of the in-process app")
+    parser.add_argument("--db", help="database path for the in-process app (default: temp file)")
+    parser.add_argument(
+        "--ops-token",
+        default=os.getenv("ORACLE_CHOICE_OPS_TOKEN"),
+        help="token for GET /metrics (default: ORACLE_CHOICE_OPS_TOKEN)",
+    )
+    args = parser.parse_args()
+
+    if not args.url:
+        # The in-process app reads its configuration at import time.
+        os.environ.setdefault("LLM_PROVIDERS", "stub")
+        os.environ.setdefault("LLM_STUB_SEED", str(args.seed))
+        db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="oracle-load-"), "load.db")
+        os.environ["ORACLE_CHOICE_DB_PATH"] = db_path
+        if not args.ops_token:
+            args.ops_token = os.environ["ORACLE_CHOICE_OPS_TOKEN"] = secrets.token_urlsafe(16)
+        print(f"[load] in-process app, providers={os.environ['LLM_PROVIDERS']} db={db_path}")
+
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
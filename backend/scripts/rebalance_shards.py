@@ -0,0 +1,66 @@
+﻿from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.storage.db import Storage  # noqa: E402
+from app.storage.sharding import MANIFEST_NAME, ShardedStorage  # noqa: E402
+
+
+TABLES = ["sessions", "messages", "readings", "agent_traces", "session_summaries", "usage"]
+
+
+def copy_table(
+    source: sqlite3.Connection, target: ShardedStorage, table: str, batch_size: int
+) -> int:
+    columns = [row[1] for row in source.execute(f"PRAGMA table_info({table})")]
+    cursor = source.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid")
+    copied = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return copied
+        copied += target.import_rows(table, columns, rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Split a single-file oracle_choice.db into session-hashed shards."
+    )
+    parser.add_argument("source", help="path to the existing single-file database")
+    parser.add_argument("target_dir", help="directory for the shard files and manifest")
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.shards < 2:
+        raise SystemExit("--shards must be at least 2.")
+    if os.path.exists(os.path.join(args.target_dir, MANIFEST_NAME)):
+        raise SystemExit(f"{args.target_dir} already contains a shard manifest.")
+
+    # Bring the source up to the current schema so every column exists.
+    Storage(args.source).close()
+
+    target = ShardedStorage(args.target_dir, args.shards)
+    source = sqlite3.connect(f"file:{args.source}?mode=ro", uri=True)
+    try:
+        for table in TABLES:
+            started = time.perf_counter()
+            copied = copy_table(source, target, table, args.batch_size)
+            print(f"[{table}] rows={copied} elapsed={time.perf_counter() - started:.2f}s")
+    finally:
+        source.close()
+        target.close()
+
+    print(f"Wrote {args.shards} shards to {args.target_dir}")
+    print(f"Start the API with ORACLE_CHOICE_DB_SHARDS={args.shards} "
+          f"ORACLE_CHOICE_DB_SHARD_DIR={args.target_dir}")
+
+
+if __name__ == "__main__":
+    main()
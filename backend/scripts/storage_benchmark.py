@@ -0,0 +1,166 @@
+﻿from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.storage.db import SCHEMA, Storage  # noqa: E402
+
+
+SYMBOLS = [{"name": "The Star", "position": "present", "upright": True}]
+ADVICE = ["保持耐心", "先做最关键的一步"]
+TRACE = [
+    {"node": node, "input": {"question": "面试能过吗"}, "output": {"ok": True}}
+    for node in ["parse", "route", "divination", "narration", "persist"]
+]
+
+
+class LegacyStorage:
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            conn.commit()
+
+    def upsert_session(self, session_id: str) -> None:
+        now = _utc_now()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO sessions (id, created_at, last_active_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET last_active_at = excluded.last_active_at
+                """,
+                (session_id, now, now),
+            )
+            conn.commit()
+
+    def add_message(self, session_id: str, role: str, content: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                (session_id, role, content, _utc_now()),
+            )
+            conn.commit()
+
+    def add_reading(self, session_id: str, tool: str, symbols: Any, verdict: str, advice: Any) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO readings (session_id, tool, symbols, verdict, advice, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    session_id,
+                    tool,
+                    json.dumps(symbols, ensure_ascii=False),
+                    verdict,
+                    json.dumps(advice, ensure_ascii=False),
+                    _utc_now(),
+                ),
+            )
+            conn.commit()
+
+    def add_trace(self, session_id: str, trace: List[Dict[str, Any]]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO agent_traces (session_id, trace, created_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(trace, ensure_ascii=False), _utc_now()),
+            )
+            conn.commit()
+
+    def get_recent_messages(self, session_id: str, limit: int = 5) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT role, content, created_at FROM messages WHERE session_id = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def close(self) -> None:
+        return None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+
+def run_turn(storage: Any, turn: int, sessions: int) -> None:
+    session_id = f"bench-{turn % sessions}"
+    storage.get_recent_messages(session_id, limit=5)
+    storage.upsert_session(session_id)
+    storage.add_message(session_id, "user", "面试能过吗")
+    storage.add_message(session_id, "assistant", "从六爻的结果看：行动力强，适合主动推进。")
+    storage.add_reading(session_id, "liuyao", SYMBOLS, "行动力强", ADVICE)
+    storage.add_trace(session_id, TRACE)
+
+
+def run_batched_turn(storage: Any, turn: int, sessions: int) -> None:
+    session_id = f"bench-{turn % sessions}"
+    storage.get_recent_messages(session_id, limit=5)
+    storage.record_turn(
+        session_id,
+        question="面试能过吗",
+        message="从六爻的结果看：行动力强，适合主动推进。",
+        tool="liuyao",
+        symbols=SYMBOLS,
+        verdict="行动力强",
+        advice=ADVICE,
+        trace=TRACE,
+    )
+
+
+def measure(
+    label: str,
+    factory: Callable[[str], Any],
+    turns: int,
+    threads: int,
+    sessions: int,
+    turn_fn: Callable[[Any, int, int], None] = run_turn,
+) -> float:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = factory(os.path.join(tmp_dir, "bench.db"))
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda turn: turn_fn(storage, turn, sessions), range(turns)))
+        elapsed = time.perf_counter() - started
+        storage.close()
+
+    rate = turns / elapsed if elapsed else 0.0
+    print(f"[{label}] turns={turns} threads={threads} elapsed={elapsed:.2f}s turns/s={rate:.1f}")
+    return rate
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark /chat persistence throughput.")
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=50)
+    args = parser.parse_args()
+
+    before = measure("before", LegacyStorage, args.turns, args.threads, args.sessions)
+    after = measure("after", Storage, args.turns, args.threads, args.sessions)
+    batched = measure(
+        "record_turn", Storage, args.turns, args.threads, args.sessions, run_batched_turn
+    )
+    if before:
+        print(f"speedup={after / before:.2f}x record_turn_speedup={batched / before:.2f}x")
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+if __name__ == "__main__":
+    main()